@@ -1,7 +1,23 @@
-import csv
-import re
+import html
+import sqlite3
+
+import numpy as np
 import streamlit as st
 
+from calculator import INGREDIENT_CELLS, RESULT_CACHE, Formulation, calculate
+from engine import load_nutrient_matrix
+from formulas import COST_CELLS, OUTPUT_CELLS, RESULT_CELLS
+from optimize import DEFAULT_BATCH_SIZE, InfeasibleFormulation, least_cost
+from prices import PriceBook, price_history
+from profiling import PROFILER, log_counters, prometheus_text
+from schema import SCHEMA
+from sensitivity import sensitivity
+from search import ingredient_index_for
+from sheet import load_sheet
+from store import open_store
+from sweep import SWEEP_METRICS, axis_values, sweep
+from workspace import Workspace
+
 # Page configuration
 st.set_page_config(
     page_title="Suryacore Feed Formulator",
@@ -10,550 +26,60 @@ st.set_page_config(
 )
 
 csv_file = "converted_file.csv"
-header_row = True
-header_col = True
-# Updated prompt_cells to include K2-K15 range
-prompt_cells = {f"B{i}" for i in range(2, 32)} | {f"K{i}" for i in range(2, 16)}  # B2-B31 and K2-K15
-computed_cache = {}    # cache for already computed cells
-
-def parse_cell_ref(cell_ref):
-    col_letters = ''.join(filter(str.isalpha, cell_ref)).upper()
-    row_number_1based = int(''.join(filter(str.isdigit, cell_ref)))
-    col_index_0based = 0
-    for ch in col_letters:
-        col_index_0based = col_index_0based * 26 + (ord(ch) - ord('A') + 1)
-    col_index_0based -= 1
-    return row_number_1based, col_index_0based, col_letters
-
-def excel_to_csv_indices(row_number_1based, col_index_0based):
-    csv_row = row_number_1based if header_row else (row_number_1based - 1)
-    csv_col = (col_index_0based + 1) if header_col else col_index_0based
-    return csv_row, csv_col
-
-def parse_number(s):
-    if s is None:
-        return None
-    s = str(s).strip()
-    if s == "":
-        return None
-    s2 = s.replace(",", "")
-    m = re.search(r"-?\d+(?:\.\d+)?", s2)
-    if m:
-        return float(m.group())
-    return None
+# Ingredient cells, names, kinds and aliases come from schema.json
+prompt_cells = set(INGREDIENT_CELLS)  # B2-B31 and K2-K15
+labels = dict(zip(SCHEMA.ingredient_cells, SCHEMA.ingredient_names))
+aliases = dict(zip(SCHEMA.ingredient_cells, SCHEMA.ingredient_aliases))
+feed_cells = {cell for cell, kind in zip(SCHEMA.ingredient_cells, SCHEMA.ingredient_kinds) if kind == "feed"}
 
 try:
-    with open(csv_file, newline='') as f:
-        reader = csv.reader(f)
-        sheet = list(reader)
+    # Parsed once per process and shared across sessions until the file changes
+    sheet_data = load_sheet(csv_file)
+    sheet_grid = sheet_data.grid
+    nutrient_matrix = load_nutrient_matrix(csv_file)
 except FileNotFoundError:
     st.error("Error: converted_file.csv not found. Please ensure the CSV file is uploaded or available.")
-    sheet = []
+    sheet_grid = None
     st.stop()
 
-def get_cell_value(cell):
-    if cell in computed_cache:
-        return computed_cache[cell]
-
-    # Hardcode H20 and H21 as constants to break circular reference
-    if cell == "H20":
-        computed_cache[cell] = 0.0
-        return 0.0
-    if cell == "H21":
-        computed_cache[cell] = 3000.0
-        return 3000.0
-
-    row1b, col0b, _ = parse_cell_ref(cell)
-    csv_r, csv_c = excel_to_csv_indices(row1b, col0b)
-
-    try:
-        raw = sheet[csv_r][csv_c]
-        num = parse_number(raw)
-        if num is not None:
-            computed_cache[cell] = num
-            return num
-    except IndexError:
-        pass
-
-    computed_cache[cell] = 0.0
-    return 0.0
-
-def sum_range(start_cell, end_cell):
-    start_row, start_col, col_letters = parse_cell_ref(start_cell)
-    end_row, _, _ = parse_cell_ref(end_cell)
-    total = 0
-    for r in range(start_row, end_row + 1):
-        total += get_cell_value(f"{col_letters}{r}")
-    return total
-
-def sum_range_cells(cell_list):
-    total = 0
-    for cell in cell_list:
-        total += get_cell_value(cell)
-    return total
-
-def sumproduct(range1_start, range1_end, range2_start, range2_end):
-    start_row1, start_col1, col_letters1 = parse_cell_ref(range1_start)
-    end_row1, _, _ = parse_cell_ref(range1_end)
-    start_row2, start_col2, col_letters2 = parse_cell_ref(range2_start)
-    total = 0
-    for i in range(end_row1 - start_row1 + 1):
-        total += get_cell_value(f"{col_letters1}{start_row1 + i}") * get_cell_value(f"{col_letters2}{start_row2 + i}")
-    return total
-
-# --- Define formula logic (keeping all your existing functions) ---
-def calc_F1():
-    val = sum_range("B2", "B41")
-    computed_cache["F1"] = val
-    return val
-
-def calc_C83():
-    val = sumproduct("B2", "B41", "C43", "C82")
-    computed_cache["C83"] = val
-    return val
-
-def calc_F83():
-    val = sumproduct("B2", "B41", "F43", "F82")
-    computed_cache["F83"] = val
-    return val
-
-def calc_D83():
-    val = sumproduct("B2", "B41", "D43", "D82")
-    computed_cache["D83"] = val
-    return val
-
-def calc_J83():
-    val = sumproduct("B2", "B41", "J43", "J82")
-    computed_cache["J83"] = val
-    return val
-
-def calc_K83():
-    val = sumproduct("B2", "B41", "K43", "K82")
-    computed_cache["K83"] = val
-    return val
-
-def calc_L83():
-    val = sumproduct("B2", "B41", "L43", "L82")
-    computed_cache["L83"] = val
-    return val
-
-def calc_M83():
-    val = sumproduct("B2", "B41", "M43", "M82")
-    computed_cache["M83"] = val
-    return val
-
-def calc_G83():
-    val = sumproduct("B2", "B41", "G43", "G82")
-    computed_cache["G83"] = val
-    return val
-
-def calc_H83():
-    val = sumproduct("B2", "B41", "H43", "H82")
-    computed_cache["H83"] = val
-    return val
-
-def calc_I83():
-    val = sumproduct("B2", "B41", "I43", "I82")
-    computed_cache["I83"] = val
-    return val
-
-def calc_W83():
-    val = sumproduct("B2", "B41", "W43", "W82")
-    computed_cache["W83"] = val
-    return val
-
-def calc_X83():
-    val = sumproduct("B2", "B41", "X43", "X82")
-    computed_cache["X83"] = val
-    return val
-
-def calc_Y83():
-    val = sumproduct("B2", "B41", "Y43", "Y82")
-    computed_cache["Y83"] = val
-    return val
-
-def calc_Z83():
-    val = sumproduct("B2", "B41", "Z43", "Z82")
-    computed_cache["Z83"] = val
-    return val
-
-def calc_AA83():
-    val = sumproduct("B2", "B41", "AA43", "AA82")
-    computed_cache["AA83"] = val
-    return val
-
-def calc_AB83():
-    val = sumproduct("B2", "B41", "AB43", "AB82")
-    computed_cache["AB83"] = val
-    return val
-
-def calc_AC83():
-    val = sumproduct("B2", "B41", "AC43", "AC82")
-    computed_cache["AC83"] = val
-    return val
-
-def calc_AD83():
-    val = sumproduct("B2", "B41", "AD43", "AD82")
-    computed_cache["AD83"] = val
-    return val
-
-def calc_AE83():
-    val = sumproduct("B2", "B41", "AE43", "AE82")
-    computed_cache["AE83"] = val
-    return val
-
-def calc_AF83():
-    val = sumproduct("B2", "B41", "AF43", "AF82")
-    computed_cache["AF83"] = val
-    return val
-
-def calc_B83():
-    val = sumproduct("B2", "B41", "B43", "B82")
-    computed_cache["B83"] = val
-    return val
-
-def calc_M2():
-    val = get_cell_value("K2") * get_cell_value("L2") / 1000
-    computed_cache["M2"] = val
-    return val
-
-def calc_M25():
-    val = get_cell_value("K25") * get_cell_value("L25") / 1000
-    computed_cache["M25"] = val
-    return val
-
-def calc_M26():
-    val = sum_range("M2", "M25")
-    computed_cache["M26"] = val
-    return val
-
-def calc_T18():
-    val = sum_range("T16", "T17")
-    computed_cache["T18"] = val
-    return val
-
-def calc_Z19():
-    val = sum_range("Z2", "Z17") / get_cell_value("Z18") if get_cell_value("Z18") != 0 else 0.0
-    computed_cache["Z19"] = val
-    return val
-
-def calc_F2():
-    val = calc_C83() / calc_F1() if calc_F1() != 0 else 0.0
-    computed_cache["F2"] = val
-    return val
-
-def calc_F3():
-    val = calc_F83() / calc_F1() if calc_F1() != 0 else 0.0
-    computed_cache["F3"] = val
-    return val
-
-def calc_F4():
-    val = (calc_F3() / calc_F2() * 1000) if calc_F2() != 0 else 0.0
-    computed_cache["F4"] = val
-    return val
-
-def calc_F5():
-    val = calc_D83() / calc_F1() if calc_F1() != 0 else 0.0
-    computed_cache["F5"] = val
-    return val
-
-def calc_F6():
-    val = calc_J83() / calc_F1() if calc_F1() != 0 else 0.0
-    computed_cache["F6"] = val
-    return val
-
-def calc_F7():
-    val = calc_K83() / calc_F1() if calc_F1() != 0 else 0.0
-    computed_cache["F7"] = val
-    return val
-
-def calc_F8():
-    val = calc_L83() / calc_F1() if calc_F1() != 0 else 0.0
-    computed_cache["F8"] = val
-    return val
-
-def calc_F9():
-    val = calc_F7() + calc_F8()
-    computed_cache["F9"] = val
-    return val
-
-def calc_F10():
-    val = calc_M83() / calc_F1() if calc_F1() != 0 else 0.0
-    computed_cache["F10"] = val
-    return val
-
-def calc_F11():
-    val = calc_G83() / calc_F1() if calc_F1() != 0 else 0.0
-    computed_cache["F11"] = val
-    return val
-
-def calc_F12():
-    val = calc_H83() / calc_F1() if calc_F1() != 0 else 0.0
-    computed_cache["F12"] = val
-    return val
-
-def calc_F13():
-    val = calc_I83() / calc_F1() if calc_F1() != 0 else 0.0
-    computed_cache["F13"] = val
-    return val
-
-def calc_F24():
-    val = calc_W83() / calc_F1() if calc_F1() != 0 else 0.0
-    computed_cache["F24"] = val
-    return val
-
-def calc_F25():
-    val = calc_X83() / calc_F1() if calc_F1() != 0 else 0.0
-    computed_cache["F25"] = val
-    return val
-
-def calc_F26():
-    val = calc_Y83() / calc_F1() if calc_F1() != 0 else 0.0
-    computed_cache["F26"] = val
-    return val
-
-def calc_F27():
-    val = calc_Z83() / calc_F1() if calc_F1() != 0 else 0.0
-    computed_cache["F27"] = val
-    return val
-
-def calc_F28():
-    val = calc_AA83() / calc_F1() if calc_F1() != 0 else 0.0
-    computed_cache["F28"] = val
-    return val
-
-def calc_F29():
-    val = calc_AB83() / calc_F1() if calc_F1() != 0 else 0.0
-    computed_cache["F29"] = val
-    return val
-
-def calc_F30():
-    val = calc_AC83() / calc_F1() if calc_F1() != 0 else 0.0
-    computed_cache["F30"] = val
-    return val
-
-def calc_F31():
-    val = calc_AD83() / calc_F1() if calc_F1() != 0 else 0.0
-    computed_cache["F31"] = val
-    return val
-
-def calc_F32():
-    val = calc_AE83() / 1000
-    computed_cache["F32"] = val
-    return val
-
-def calc_F33():
-    val = calc_AF83() / 1000
-    computed_cache["F33"] = val
-    return val
-
-
-
-def calc_F17():
-    val = calc_F24() / 10
-    computed_cache["F17"] = val
-    return val
-
-def calc_F18():
-    val = calc_F25() / 10
-    computed_cache["F18"] = val
-    return val
-
-def calc_F16():
-    val = calc_F26() / calc_F25() if calc_F25() != 0 else 0.0
-    computed_cache["F16"] = val
-    return val
-
-def calc_F15():
-    val = calc_F17() / calc_F18() if calc_F18() != 0 else 0.0
-    computed_cache["F15"] = val
-    return val
-
-def calc_F19():
-    val = calc_F26() / 10
-    computed_cache["F19"] = val
-    return val
-
-def calc_F14():
-    val = (calc_F25() / 23 + calc_F26() / 39 - calc_F24() / 35) * 100
-    computed_cache["F14"] = val
-    return val
-
-def calc_F20():
-    # Check if all ingredients in the list have cost data
-    for cell in st.session_state.ingredient_list:
-        if st.session_state.ingredient_list[cell].get('cost', 0) <= 0:
-            return "NA"  # Return "NA" if any ingredient lacks cost data
-    
-    # Calculate total cost if all ingredients have cost data
-    total_cost = 0
-    for cell, data in st.session_state.ingredient_list.items():
-        total_cost += data['quantity'] * data['cost']
-    
-    total_quantity = calc_F1()
-    if total_quantity == 0:
-        return "NA"
-    
-    val = total_cost / total_quantity
-    computed_cache["F20"] = val
-    return val
-
-def calc_F21():
-    cost_per_kg = calc_F20()
-    if cost_per_kg == "NA":
-        return "NA"
-    val = cost_per_kg * 75
-    computed_cache["F21"] = val
-    return val
-
-def calc_F22():
-    cost_per_bag = calc_F21()
-    if cost_per_bag == "NA":
-        return "NA"
-    val = get_cell_value("H21") - cost_per_bag
-    computed_cache["F22"] = val
-    return val
-
-# NEW OUTPUT CALCULATION FUNCTIONS FOR B39-B41
-# CORRECTED OUTPUT CALCULATION FUNCTIONS FOR F34-F41
-# CORRECTED OUTPUT CALCULATION FUNCTIONS FOR F34-F41
-def calc_F34(): 
-    # K2 is separate user input for Premix
-    user_quantity_k2 = st.session_state.ingredient_list.get("K2", {}).get('quantity', 0)
-    return user_quantity_k2 * 82500 / calc_F1() if calc_F1() != 0 else 0.0
-
-def calc_F35(): 
-    # K3 and K12 are separate user inputs for Bcomplex and Vit E 50%
-    user_quantity_k3 = st.session_state.ingredient_list.get("K3", {}).get('quantity', 0)
-    user_quantity_k12 = st.session_state.ingredient_list.get("K12", {}).get('quantity', 0)
-    return (user_quantity_k3 * 40 + user_quantity_k12 * 0.5 * 1000) / calc_F1() if calc_F1() != 0 else 0.0
-
-def calc_F36(): 
-    # K2 is separate user input for Premix
-    user_quantity_k2 = st.session_state.ingredient_list.get("K2", {}).get('quantity', 0)
-    return user_quantity_k2 * 10 / calc_F1() if calc_F1() != 0 else 0.0
-
-def calc_F37(): 
-    # K11 is separate user input for Biotin 2%
-    user_quantity_k11 = st.session_state.ingredient_list.get("K11", {}).get('quantity', 0)
-    return user_quantity_k11 * 0.02 * 1000 * 1000 / calc_F1() if calc_F1() != 0 else 0.0
-
-def calc_F38(): 
-    # K7 is separate user input for Choline
-    user_quantity_k7 = st.session_state.ingredient_list.get("K7", {}).get('quantity', 0)
-    return user_quantity_k7 * 0.6
-
-def calc_F39(): 
-    # K3 is separate user input for Bcomplex
-    user_quantity_k3 = st.session_state.ingredient_list.get("K3", {}).get('quantity', 0)
-    return user_quantity_k3 * 3 / calc_F1() if calc_F1() != 0 else 0.0
-
-def calc_F40(): 
-    # K3 is separate user input for Bcomplex
-    user_quantity_k3 = st.session_state.ingredient_list.get("K3", {}).get('quantity', 0)
-    return user_quantity_k3 * 60 / calc_F1() if calc_F1() != 0 else 0.0
-
-def calc_F41(): 
-    # K3 is separate user input for Bcomplex
-    user_quantity_k3 = st.session_state.ingredient_list.get("K3", {}).get('quantity', 0)
-    return user_quantity_k3 * 40 / calc_F1() if calc_F1() != 0 else 0.0
-
-# CORRECTED OUTPUT CALCULATION FUNCTIONS FOR H24-H39
-# These are using sumproduct results which should be correct, but let me show the pattern:
-def calc_H24(): return calc_N83() / calc_F1() if calc_F1() != 0 else 0.0
-def calc_H25(): return calc_O83() / calc_F1() if calc_F1() != 0 else 0.0
-def calc_H26(): return calc_P83() / calc_F1() if calc_F1() != 0 else 0.0
-def calc_H27(): return calc_Q83() / calc_F1() if calc_F1() != 0 else 0.0
-def calc_H28(): return calc_R83() / calc_F1() if calc_F1() != 0 else 0.0
-def calc_H29(): return calc_S83() / calc_F1() if calc_F1() != 0 else 0.0
-def calc_H30(): return calc_T83() / calc_F1() if calc_F1() != 0 else 0.0
-def calc_H31(): return calc_U83() / calc_F1() if calc_F1() != 0 else 0.0
-def calc_H32(): return calc_V83() / calc_F1() if calc_F1() != 0 else 0.0
-def calc_H33(): return calc_AS83() / calc_F1() if calc_F1() != 0 else 0.0
-def calc_H34(): return calc_E83() / calc_F1() if calc_F1() != 0 else 0.0
-
-def calc_H35(): 
-    # K3 is separate user input for Bcomplex
-    user_quantity_k3 = st.session_state.ingredient_list.get("K3", {}).get('quantity', 0)
-    return user_quantity_k3 * 8 / calc_F1() if calc_F1() != 0 else 0.0
-
-def calc_H36(): 
-    # K2 is separate user input for Premix
-    user_quantity_k2 = st.session_state.ingredient_list.get("K2", {}).get('quantity', 0)
-    return user_quantity_k2 * 50 / calc_F1() if calc_F1() != 0 else 0.0
-
-def calc_H37(): 
-    # K3 is separate user input for Bcomplex
-    user_quantity_k3 = st.session_state.ingredient_list.get("K3", {}).get('quantity', 0)
-    return user_quantity_k3 * 4 / calc_F1() if calc_F1() != 0 else 0.0
-
-def calc_H38(): 
-    # K3 is separate user input for Bcomplex
-    user_quantity_k3 = st.session_state.ingredient_list.get("K3", {}).get('quantity', 0)
-    return user_quantity_k3 * 40 / calc_F1() if calc_F1() != 0 else 0.0
-
-def calc_H39(): 
-    # K2 and K6 are separate user inputs for Premix and Dicerol
-    user_quantity_k2 = st.session_state.ingredient_list.get("K2", {}).get('quantity', 0)
-    user_quantity_k6 = st.session_state.ingredient_list.get("K6", {}).get('quantity', 0)
-    return (user_quantity_k2 * 12000 + user_quantity_k6 * 600000) / calc_F1() if calc_F1() != 0 else 0.0
-
-# You'll also need these missing sumproduct functions for the H24-H34 calculations:
-def calc_N83():
-    val = sumproduct("B2", "B41", "N43", "N82")
-    computed_cache["N83"] = val
-    return val
-
-def calc_O83():
-    val = sumproduct("B2", "B41", "O43", "O82")
-    computed_cache["O83"] = val
-    return val
-
-def calc_P83():
-    val = sumproduct("B2", "B41", "P43", "P82")
-    computed_cache["P83"] = val
-    return val
-
-def calc_Q83():
-    val = sumproduct("B2", "B41", "Q43", "Q82")
-    computed_cache["Q83"] = val
-    return val
-
-def calc_R83():
-    val = sumproduct("B2", "B41", "R43", "R82")
-    computed_cache["R83"] = val
-    return val
-
-def calc_S83():
-    val = sumproduct("B2", "B41", "S43", "S82")
-    computed_cache["S83"] = val
-    return val
-
-def calc_T83():
-    val = sumproduct("B2", "B41", "T43", "T82")
-    computed_cache["T83"] = val
-    return val
-
-def calc_U83():
-    val = sumproduct("B2", "B41", "U43", "U82")
-    computed_cache["U83"] = val
-    return val
-
-def calc_V83():
-    val = sumproduct("B2", "B41", "V43", "V82")
-    computed_cache["V83"] = val
-    return val
-
-def calc_AS83():
-    val = sumproduct("B2", "B41", "AS43", "AS82")
-    computed_cache["AS83"] = val
-    return val
-
-def calc_E83():
-    val = sumproduct("B2", "B41", "E43", "E82")
-    computed_cache["E83"] = val
-    return val
-
+# History table: the newest matches, with these outputs alongside
+HISTORY_ROWS = 200
+HISTORY_OUTPUTS = ["F1", "F2", "F3", "F20"]
+
+# Results panel sections, each listing its output cells
+RESULT_GROUPS = [
+    (group, [cell for cell, g in zip(SCHEMA.output_cells, SCHEMA.output_groups) if g == group])
+    for group in SCHEMA.groups
+]
+
+# Versioned price lists in price_tables/, loaded once per process and shared by every session
+price_book = PriceBook()
+# Every calculated formulation is kept in formulations.db, shared by every session
+formulation_store = open_store()
+
+def active_price_version(ingredient_list):
+    # The chosen price version, if every entered cost still matches it
+    version = st.session_state.get("price_version")
+    if version is None or version not in price_book:
+        return None
+    table = price_book.get(version)
+    for cell, data in ingredient_list.items():
+        if table.cost(cell) != data.get('cost'):
+            return None
+    return version
+
+def results_table_html(results):
+    # The whole results panel as one HTML table, so it ships to the browser as a single element
+    output_labels = {cell: label for label, cell in RESULT_CELLS}
+    rows = []
+    for group, cells in RESULT_GROUPS:
+        rows.append(f'<tr class="result-group"><th colspan="2">{group}</th></tr>')
+        for cell in cells:
+            label = output_labels[cell]
+            value = results[label]
+            shown = "NA" if value == "NA" else f"{value:.4f}"
+            rows.append(f'<tr><td>{html.escape(label)}</td><td>{shown}</td></tr>')
+    return f'<table class="result-table">{"".join(rows)}</table>'
 
 # Initialize session state for ingredient list
 if 'ingredient_list' not in st.session_state:
@@ -595,13 +121,30 @@ st.markdown("""
         margin-bottom: 1rem;
         font-size: 0.8rem;
     }
-    .result-item {
+    .result-table {
+        width: 100%;
+        border-collapse: separate;
+        border-spacing: 0 1px;
+        font-size: 0.85rem;
+    }
+    .result-table td {
         background-color: #000000;
         padding: 6px;
-        margin: 1px 0;
-        border-radius: 3px;
+        border: none;
+    }
+    .result-table td:first-child {
         border-left: 3px solid #28a745;
-        font-size: 0.85rem;
+        font-weight: bold;
+    }
+    .result-table td:last-child {
+        text-align: right;
+    }
+    .result-group th {
+        color: #4682B4;
+        border: none;
+        border-bottom: 2px solid #4682B4;
+        padding: 8px 0 4px 0;
+        text-align: left;
     }
     .ingredient-item {
         background-color: #f8f9fa;
@@ -670,18 +213,10 @@ if st.session_state.get("_queue_calculation", False):
 with left_col:
     st.markdown('<h3 class="section-header"> 📋ADD INGREDIENTS</h3>', unsafe_allow_html=True)
 
-    # Ingredient labels
-    labels = {
-        "B2": "Maize", "B3": "Jowar", "B4": "B.Rice", "B5": "Wheat", "B6": "Bajra", "B7": "Ragi",
-        "B8": "R.Polish", "B9": "DORB", "B10": "SFOC", "B11": "DOGN", "B12": "SOYA", "B13": "Fish Meal",
-        "B14": "RSM", "B15": "LSP", "B16": "SG", "B17": "Mustard Meal", "B18": "DCP", "B19": "MOLASES",
-        "B20": "MEAT AND BONE Meal", "B21": "Oil", "B22": "MGM", "B23": "Methionine", "B24": "Lysine",
-        "B25": "Betaine", "B26": "Cocktail Enzyme", "B27": "Phytase", "B28": "SodaBicarb", "B29": "Salt",
-        "B30": "TM MIX", "B31": "Rice DDGS",
-        "K2": "Premix", "K3": "Bcomplex", "K4": "Toxin Binder", "K5": "Liver", "K6": "Dicerol",
-        "K7": "Choline", "K8": "Osconite", "K9": "Anti Coccidial", "K10": "Probiotic", "K11": "Biotin 2%",
-        "K12": "Vit E 50%", "K13": "AGP", "K14": "Acidifier", "K15": "Emulsifier"
-    }
+    # Search index over the ingredient names and aliases, built once per catalogue
+    ingredient_index = ingredient_index_for(
+        SCHEMA.digest, {cell: labels.get(cell, cell) for cell in sorted(prompt_cells)}, aliases
+    )
 
     # Initialize session state
     if 'selected_ingredients' not in st.session_state:
@@ -690,6 +225,11 @@ with left_col:
         st.session_state.ingredient_list = {}
     if 'search_query' not in st.session_state:
         st.session_state.search_query = ""
+    if 'workspace' not in st.session_state:
+        st.session_state.workspace = Workspace()
+    if 'price_version' not in st.session_state:
+        latest = price_book.latest()
+        st.session_state.price_version = latest.version if latest else None
 
     # Handle clear all action - this must happen before rendering checkboxes
     if st.session_state.get("clear_all_triggered", False):
@@ -698,6 +238,7 @@ with left_col:
         st.session_state.ingredient_list = {}
         st.session_state.trigger_calculation = False
         st.session_state._queue_calculation = False
+        st.session_state.last_calculation = None
         
         # Set all checkboxes to False
         for cell in sorted(prompt_cells):
@@ -708,112 +249,264 @@ with left_col:
         # Reset the trigger
         st.session_state.clear_all_triggered = False
 
-    # Search functionality
-    st.markdown("##### 🔍 Search Ingredients")
-    search_query = st.text_input(
-        "Type to search ingredients...",
-        value=st.session_state.search_query,
-        placeholder="e.g., Maize, Soya, Oil, etc.",
-        key="ingredient_search",
-        help="Search by ingredient name to filter the list below"
-    )
-    
-    # Update session state with search query
-    st.session_state.search_query = search_query
-
-    # Filter ingredients based on search query
-    if search_query.strip():
-        filtered_cells = [
-            cell for cell in sorted(prompt_cells) 
-            if search_query.lower() in labels.get(cell, cell).lower()
-        ]
-        if not filtered_cells:
-            st.info(f"No ingredients found matching '{search_query}'")
-    else:
-        filtered_cells = sorted(prompt_cells)
-
-    # Show ingredient count
-    total_ingredients = len(prompt_cells)
-    showing_count = len(filtered_cells)
-    if search_query.strip():
-        st.caption(f"Showing {showing_count} of {total_ingredients} ingredients")
-    else:
-        st.caption(f"Showing all {total_ingredients} ingredients")
-
-    st.markdown('<h3 class="section-header"></h3>', unsafe_allow_html=True)
+    # Apply a solved least-cost mix to the quantity inputs before they are rendered
+    if st.session_state.get("optimized_quantities"):
+        for cell, qty in st.session_state.optimized_quantities.items():
+            st.session_state[f"qty_{cell}"] = qty
+        st.session_state.optimized_quantities = None
+
+    # Load a saved or stored formulation into the inputs before they are rendered, then calculate it
+    if st.session_state.get("load_formulation"):
+        formulation = st.session_state.load_formulation
+        st.session_state.selected_ingredients = set(formulation.quantities)
+        st.session_state.ingredient_list = {}
+        for cell in sorted(prompt_cells):
+            used = cell in formulation.quantities
+            st.session_state[f"chk_{cell}"] = used
+            st.session_state[f"qty_{cell}"] = formulation.quantities[cell] if used else 0.0
+            st.session_state[f"cost_{cell}"] = formulation.costs.get(cell, 0.0) if used else 0.0
+            if used:
+                st.session_state.ingredient_list[cell] = {
+                    'name': labels.get(cell, cell),
+                    'quantity': formulation.quantities[cell],
+                    'cost': formulation.costs.get(cell, 0.0)
+                }
+        if formulation.price_version is not None:
+            st.session_state.price_version = formulation.price_version
+        st.session_state.load_formulation = None
+        st.session_state.last_calculation = None    # a different mix: calculate it afresh
+        st.session_state._queue_calculation = True
+        st.rerun()
+
+    # Fill the cost inputs from a price version before they are rendered
+    if st.session_state.get("apply_price_version"):
+        table = price_book.get(st.session_state.apply_price_version)
+        for cell in sorted(prompt_cells):
+            cost = table.cost(cell)
+            if cost is not None:
+                st.session_state[f"cost_{cell}"] = cost
+                if cell in st.session_state.ingredient_list:
+                    st.session_state.ingredient_list[cell]['cost'] = cost
+        st.session_state.price_version = table.version
+        st.session_state.apply_price_version = None
+
+    # Importing a price list or switching versions reruns only this fragment until prices are
+    # applied. Drawn after the editor, so a full rerun from here keeps every input's value.
+    @st.experimental_fragment
+    def price_list_panel():
+        versions = price_book.versions()
+        current = st.session_state.price_version
+        with st.expander(f"💲 Price list ({current or 'manual costs'})", expanded=False):
+            if versions:
+                col_pick, col_apply = st.columns([3, 1])
+                with col_pick:
+                    picked = st.selectbox(
+                        "Price version", versions[::-1],
+                        index=versions[::-1].index(current) if current in versions else 0,
+                        key="price_pick"
+                    )
+                with col_apply:
+                    st.write("")
+                    if st.button("Apply prices"):
+                        st.session_state.apply_price_version = picked
+                        st.rerun()
+                unpriced = price_book.get(picked).unpriced(sorted(st.session_state.selected_ingredients))
+                if unpriced:
+                    st.caption("Not priced in this version: " + ", ".join(labels.get(c, c) for c in unpriced))
+            else:
+                st.caption("No price lists imported yet.")
+
+            uploaded = st.file_uploader("Import price list (CSV or JSON)", type=["csv", "json"], key="price_file")
+            version_name = st.text_input("Version name", placeholder="default: from the file, else today's date",
+                                         key="price_version_name")
+            if uploaded is not None and st.button("Import"):
+                try:
+                    fmt = "json" if uploaded.name.endswith(".json") else "csv"
+                    table = price_book.import_text(
+                        uploaded.getvalue().decode("utf-8-sig"), fmt, version_name.strip() or None, uploaded.name
+                    )
+                    st.session_state.apply_price_version = table.version
+                    st.rerun()
+                except ValueError as e:
+                    st.error(f"Could not import price list: {e}")
+
+            # Cost outputs of the last calculation under every stored version
+            last_calculation = st.session_state.get("last_calculation")
+            if last_calculation is not None and len(versions) > 1:
+                history_versions, costs = price_history(last_calculation.formulation, price_book, versions, csv_file)
+                output_labels = {cell: label for label, cell in RESULT_CELLS}
+                table = {"Version": history_versions}
+                for j, cell in enumerate(COST_CELLS):
+                    table[output_labels[cell]] = [None if v != v else v for v in costs[:, j].tolist()]
+                st.dataframe(table, hide_index=True, use_container_width=True)
+
+    # Searching and ticking ingredients rerun only this fragment
+    @st.experimental_fragment
+    def ingredient_picker():
+        # Search functionality
+        st.markdown("##### 🔍 Search Ingredients")
+        search_query = st.text_input(
+            "Type to search ingredients...",
+            value=st.session_state.search_query,
+            placeholder="e.g., Maize, Soya, Oil, etc.",
+            key="ingredient_search",
+            help="Search by ingredient name to filter the list below"
+        )
     
-    # Display filtered ingredients
-    with st.container(height=300):
-        if filtered_cells:
-            for cell in filtered_cells:
-                label = labels.get(cell, cell)
-                
-                # The checkbox will use the session state value we set above
-                checked = st.checkbox(label, key=f"chk_{cell}")
-                
-                if checked:
-                    st.session_state.selected_ingredients.add(cell)
-                else:
-                    st.session_state.selected_ingredients.discard(cell)
+        # Update session state with search query
+        st.session_state.search_query = search_query
+
+        # Filter ingredients based on search query, best matches first
+        if search_query.strip():
+            filtered_cells = ingredient_index.search(search_query)
+            if not filtered_cells:
+                st.info(f"No ingredients found matching '{search_query}'")
         else:
-            st.info("Use the search box above to find ingredients")
+            filtered_cells = sorted(prompt_cells)
 
-    st.markdown("### Current Ingredients:")
-    updated_ingredients = {}
+        # Show ingredient count
+        total_ingredients = len(prompt_cells)
+        showing_count = len(filtered_cells)
+        if search_query.strip():
+            st.caption(f"Showing {showing_count} of {total_ingredients} ingredients")
+        else:
+            st.caption(f"Showing all {total_ingredients} ingredients")
 
-    if st.session_state.selected_ingredients:
+        st.markdown('<h3 class="section-header"></h3>', unsafe_allow_html=True)
+    
+        # Display filtered ingredients
+        selected_before = set(st.session_state.selected_ingredients)
         with st.container(height=300):
-            for i, cell in enumerate(sorted(st.session_state.selected_ingredients)):
-                label = labels.get(cell, cell)
-                col1, col2, col3 = st.columns([2.5, 1.5, 1.5])
-
-                with col1:
-                    st.markdown(f"**{label}**")
-
-                with col2:
-                    qty = st.number_input(
-                        "Qty",
-                        min_value=0.0,
-                        step=0.1,
-                        format="%.2f",
-                        key=f"qty_{cell}"
-                    )
-
-                with col3:
-                    cost = st.number_input(
-                        "Cost",
-                        min_value=0.0,
-                        step=0.01,
-                        format="%.2f",
-                        key=f"cost_{cell}"
-                    )
-
-                updated_ingredients[cell] = {'quantity': qty, 'cost': cost}
-
-        # Calculate and Clear buttons
-        col_calc, col_clear = st.columns([1, 1])
-        with col_calc:
-            if st.button("🔍 Calculate", type="primary"):
-                for cell, data in updated_ingredients.items():
-                    qty, cost = data['quantity'], data['cost']
-                    if qty > 0:
-                        st.session_state.ingredient_list[cell] = {
-                            'name': labels.get(cell, cell),
-                            'quantity': qty,
-                            'cost': cost
-                        }
+            if filtered_cells:
+                for cell in filtered_cells:
+                    label = labels.get(cell, cell)
+                
+                    # The checkbox will use the session state value we set above
+                    checked = st.checkbox(label, key=f"chk_{cell}")
+                
+                    if checked:
+                        st.session_state.selected_ingredients.add(cell)
                     else:
-                        st.warning(f"{labels.get(cell)} skipped — quantity must be > 0")
-                st.session_state._queue_calculation = True
-                st.rerun()
+                        st.session_state.selected_ingredients.discard(cell)
+            else:
+                st.info("Use the search box above to find ingredients")
+
+        # The quantity grid lives in its own fragment, so a changed selection needs a full rerun.
+        # The grid is not drawn before that rerun, so carry its entered values over explicitly;
+        # otherwise Streamlit drops them as stale widget state. Newly ticked ingredients start
+        # at their price in the chosen version.
+        if st.session_state.selected_ingredients != selected_before:
+            for cell in selected_before:
+                for key in (f"qty_{cell}", f"cost_{cell}"):
+                    if key in st.session_state:
+                        st.session_state[key] = st.session_state[key]
+            version = st.session_state.price_version
+            if version is not None and version in price_book:
+                table = price_book.get(version)
+                for cell in st.session_state.selected_ingredients - selected_before:
+                    if not st.session_state.get(f"cost_{cell}") and table.cost(cell) is not None:
+                        st.session_state[f"cost_{cell}"] = table.cost(cell)
+            st.rerun()
+
+    # Editing quantities and costs reruns only this fragment; the buttons rerun the whole app
+    @st.experimental_fragment
+    def ingredient_editor():
+        st.markdown("### Current Ingredients:")
+        updated_ingredients = {}
+
+        if st.session_state.selected_ingredients:
+            with st.container(height=300):
+                for i, cell in enumerate(sorted(st.session_state.selected_ingredients)):
+                    label = labels.get(cell, cell)
+                    col1, col2, col3 = st.columns([2.5, 1.5, 1.5])
+
+                    with col1:
+                        st.markdown(f"**{label}**")
+
+                    with col2:
+                        qty = st.number_input(
+                            "Qty",
+                            min_value=0.0,
+                            step=0.1,
+                            format="%.2f",
+                            key=f"qty_{cell}"
+                        )
+
+                    with col3:
+                        cost = st.number_input(
+                            "Cost",
+                            min_value=0.0,
+                            step=0.01,
+                            format="%.2f",
+                            key=f"cost_{cell}"
+                        )
+
+                    updated_ingredients[cell] = {'quantity': qty, 'cost': cost}
+
+            batch_size = st.number_input(
+                "Batch size for Optimize (kg)",
+                min_value=1.0,
+                value=DEFAULT_BATCH_SIZE,
+                step=50.0,
+                key="batch_size"
+            )
+
+            # Calculate, Optimize and Clear buttons
+            col_calc, col_opt, col_clear = st.columns([1, 1, 1])
+            with col_calc:
+                if st.button("🔍 Calculate", type="primary"):
+                    for cell, data in updated_ingredients.items():
+                        qty, cost = data['quantity'], data['cost']
+                        if qty > 0:
+                            st.session_state.ingredient_list[cell] = {
+                                'name': labels.get(cell, cell),
+                                'quantity': qty,
+                                'cost': cost
+                            }
+                        else:
+                            st.warning(f"{labels.get(cell)} skipped — quantity must be > 0")
+                    st.session_state._queue_calculation = True
+                    st.rerun()
+
+            with col_opt:
+                optimize_clicked = st.button("⚙️ Optimize", type="secondary")
+
+            with col_clear:
+                if st.button("Clear All", type="secondary"):
+                    # Set the trigger flag instead of doing the clearing directly
+                    st.session_state.clear_all_triggered = True
+                    st.rerun()
+
+            if optimize_clicked:
+                # Least-cost quantities for the selected feed ingredients; additives keep their entered quantities
+                try:
+                    optimal = least_cost(
+                        nutrient_matrix,
+                        sheet_grid,
+                        {cell: data['cost'] for cell, data in updated_ingredients.items() if cell in feed_cells},
+                        batch_size
+                    )
+                except InfeasibleFormulation as e:
+                    st.error(str(e))
+                else:
+                    st.session_state.ingredient_list = {}
+                    for cell, data in updated_ingredients.items():
+                        qty = optimal.get(cell, data['quantity'])
+                        if qty > 0:
+                            st.session_state.ingredient_list[cell] = {
+                                'name': labels.get(cell, cell),
+                                'quantity': qty,
+                                'cost': data['cost']
+                            }
+                    st.session_state.optimized_quantities = optimal
+                    st.session_state._queue_calculation = True
+                    st.rerun()
+        else:
+            st.info("No ingredients selected yet. Use checkboxes above.")
 
-        with col_clear:
-            if st.button("Clear All", type="secondary"):
-                # Set the trigger flag instead of doing the clearing directly
-                st.session_state.clear_all_triggered = True
-                st.rerun()
-    else:
-        st.info("No ingredients selected yet. Use checkboxes above.")
+    ingredient_picker()
+    ingredient_editor()
+    price_list_panel()
 
 
 
@@ -823,76 +516,28 @@ with right_col:
 
     with st.container(height=600):
         if st.session_state.get("trigger_calculation", False) and st.session_state.ingredient_list:
-            for cell in prompt_cells:
-                computed_cache[cell] = st.session_state.ingredient_list.get(cell, {}).get('quantity', 0.0)
-
             try:
-                results = {
-                    "Total Quantity": calc_F1(),
-                    "Crude Protein (%)": calc_F2(),
-                    "ME (Mcal/Kg)": calc_F3(),
-                    "Calorie:Protein Ratio": calc_F4(),
-                    "Crude Fibre (%)": calc_F5(),
-                    "Lysine (%)": calc_F6(),
-                    "Methionine (%)": calc_F7(),
-                    "Cystine (%)": calc_F8(),
-                    "MET+CYS (%)": calc_F9(),
-                    "Arginine (%)": calc_F10(),
-                    "Calcium (%)": calc_F11(),
-                    "Total Phosphorus (%)": calc_F12(),
-                    "Available Phosphorus (%)": calc_F13(),
-                    "Na+K-Cl (mEq/kg)": calc_F14(),
-                    "Na:Cl Ratio": calc_F15(),
-                    "Na:K Ratio": calc_F16(),
-                    "Chloride (%)": calc_F17(),
-                    "Sodium (%)": calc_F18(),
-                    "Potassium (%)": calc_F19(),
-                    "Cost per kg": calc_F20(),
-                    "Cost per Bag": calc_F21(),
-                    "Margin": calc_F22(),
-                    "Chloride (mg/kg)": calc_F24(),
-                    "Sodium (mg/kg)": calc_F25(),
-                    "Potassium (mg/kg)": calc_F26(),
-                    "Manganese (mg/kg)": calc_F27(),
-                    "Zinc (mg/kg)": calc_F28(),
-                    "Selenium (mg/kg)": calc_F29(),
-                    "Iron (mg/kg)": calc_F30(),
-                    "Copper (mg/kg)": calc_F31(),
-                    "Cobalt (mg/kg)": calc_F32(),
-                    "Iodine (mg/kg)": calc_F33(),
-                    "Vitamin A (IU/kg)": calc_F34(),
-                    "Vitamin E (IU/kg)": calc_F35(),
-                    "Vitamin K (mg/kg)": calc_F36(),
-                    "Biotin (mcg/kg)": calc_F37(),
-                    "Choline (mg/kg)": calc_F38(),
-                    "Folicacid": calc_F39(),
-                    "Niacin": calc_F40(),
-                    "Panthothenicacid": calc_F41(),
-                    "Histidine": calc_H24(),
-                    "Leucine": calc_H25(),
-                    "Isoleucine": calc_H26(),
-                    "P.Alanine": calc_H27(),
-                    "Threonine": calc_H28(),
-                    "Tryoptophan": calc_H29(),
-                    "Tyrosine": calc_H30(),
-                    "Valine": calc_H31(),
-                    "Serine": calc_H32(),
-                    "Linoleicacid": calc_H33(),
-                    "AFT": calc_H34(),
-                    "B6": calc_H35(),
-                    "B2": calc_H36(),
-                    "B1": calc_H37(),
-                    "B12": calc_H38(),
-                    "D3": calc_H39()
-                }
-
-                for param, value in results.items():
-                    if value == "NA":
-                        st.markdown(f'<div class="result-item"><strong>{param}:</strong> NA</div>', unsafe_allow_html=True)
-                    else:
-                        st.markdown(f'<div class="result-item"><strong>{param}:</strong> {value:.4f}</div>', unsafe_allow_html=True)
+                # Reuse the previous Calculate of this session for an incremental update
+                ingredient_list = st.session_state.ingredient_list
+                calculation = calculate(
+                    Formulation.from_ingredient_list(ingredient_list, active_price_version(ingredient_list)),
+                    csv_file,
+                    st.session_state.get("last_calculation")
+                )
+                st.session_state.last_calculation = calculation
+                results = calculation.results
+                try:
+                    st.session_state.last_stored_id = formulation_store.add_calculation(calculation, csv_file)
+                except sqlite3.Error as e:
+                    st.session_state.last_stored_id = None
+                    st.warning(f"Result not saved to history: {e}")
+
+                with PROFILER.timer("render_results"):
+                    st.markdown(results_table_html(results), unsafe_allow_html=True)
 
                 st.session_state.trigger_calculation = False
+                if PROFILER.enabled:
+                    log_counters(caches={"results": RESULT_CACHE.stats()})
 
             except Exception as e:
                 st.error(f"Error in calculation: {str(e)}")
@@ -912,3 +557,228 @@ with right_col:
 
     **Note:** All calculations are based on the nutritional database from your CSV file.
     """)
+
+    # How each output moves per extra kg of each ingredient in the last calculated formulation
+    @st.experimental_fragment
+    def sensitivity_panel(formulation):
+        with st.expander("📈 Sensitivity", expanded=False):
+            step = st.number_input(
+                "Change per ingredient (kg)", value=10.0, step=1.0, format="%.2f", key="sensitivity_step"
+            )
+            result = sensitivity(formulation, path=csv_file)
+            effect = result.effect(step)
+            table = {"Output": [label for label, _ in RESULT_CELLS], "Value": result.values.tolist()}
+            for j, cell in enumerate(result.cells):
+                table[labels.get(cell, cell)] = effect[:, j].tolist()
+            st.caption(f"Estimated change in each output when one ingredient rises by {step:g} kg")
+            st.dataframe(table, hide_index=True, use_container_width=True)
+
+    # What-if grid over one or two ingredient quantities, drawn as the chunks come in
+    SWEEP_DISPLAY_POINTS = 120   # per axis; larger sweeps are thinned and only the drawn points kept
+
+    def sweep_chart(axes, values, metric):
+        # axes and values already thinned to the display grid
+        x_cell, x_values = axes[0]
+        if len(axes) == 1:
+            records = [
+                {"x": float(x), "value": float(v)}
+                for x, v in zip(x_values, values[:, metric]) if v == v
+            ]
+            return {
+                "data": {"values": records},
+                "mark": {"type": "line", "point": len(records) <= 50},
+                "encoding": {
+                    "x": {"field": "x", "type": "quantitative", "title": f"{labels.get(x_cell, x_cell)} (kg)"},
+                    "y": {"field": "value", "type": "quantitative", "title": SWEEP_METRICS[metric][0]},
+                },
+            }
+        y_cell, y_values = axes[1]
+        grid = values[:, metric].reshape(len(x_values), len(y_values))
+        records = [
+            {"x": float(x), "y": float(y), "value": float(grid[i, j])}
+            for i, x in enumerate(x_values) for j, y in enumerate(y_values) if grid[i, j] == grid[i, j]
+        ]
+        return {
+            "data": {"values": records},
+            "mark": "rect",
+            "encoding": {
+                "x": {"field": "x", "type": "ordinal", "title": f"{labels.get(x_cell, x_cell)} (kg)",
+                      "axis": {"labelOverlap": True}},
+                "y": {"field": "y", "type": "ordinal", "title": f"{labels.get(y_cell, y_cell)} (kg)",
+                      "sort": "descending", "axis": {"labelOverlap": True}},
+                "color": {"field": "value", "type": "quantitative", "title": SWEEP_METRICS[metric][0],
+                          "scale": {"scheme": "viridis"}},
+                "tooltip": [{"field": "x"}, {"field": "y"}, {"field": "value", "format": ".4f"}],
+            },
+        }
+
+    @st.experimental_fragment
+    def sweep_panel(formulation):
+        with st.expander("🔀 What-if sweep", expanded=False):
+            cells = list(formulation.quantities) + [c for c in INGREDIENT_CELLS if c not in formulation.quantities]
+            name = lambda cell: "None" if cell is None else labels.get(cell, cell)
+            col_x, col_y = st.columns(2)
+            with col_x:
+                x_cell = st.selectbox("X ingredient", cells, format_func=name, key="sweep_x")
+                x_low = st.number_input("X from (kg)", min_value=0.0, value=0.0, key="sweep_x_low")
+                x_high = st.number_input("X to (kg)", min_value=0.0, value=100.0, key="sweep_x_high")
+                x_step = st.number_input("X step (kg)", min_value=0.01, value=10.0, key="sweep_x_step")
+            with col_y:
+                y_cell = st.selectbox("Y ingredient", [None] + cells, format_func=name, key="sweep_y")
+                y_low = st.number_input("Y from (kg)", min_value=0.0, value=0.0, key="sweep_y_low")
+                y_high = st.number_input("Y to (kg)", min_value=0.0, value=100.0, key="sweep_y_high")
+                y_step = st.number_input("Y step (kg)", min_value=0.01, value=10.0, key="sweep_y_step")
+            metric = st.selectbox(
+                "Metric", range(len(SWEEP_METRICS)), format_func=lambda i: SWEEP_METRICS[i][0], key="sweep_metric"
+            )
+
+            if st.button("Run sweep"):
+                try:
+                    axes = [(x_cell, axis_values(x_low, x_high, x_step))]
+                    if y_cell is not None and y_cell != x_cell:
+                        axes.append((y_cell, axis_values(y_low, y_high, y_step)))
+                    chunks = sweep(formulation, axes, csv_file)
+                except ValueError as e:
+                    st.error(str(e))
+                    return
+                shape = tuple(len(values) for _, values in axes)
+                total = int(np.prod(shape))
+                # Every step-th point per axis is drawn, and only those are kept
+                steps = [max(1, -(-n // SWEEP_DISPLAY_POINTS)) for n in shape]
+                shown = [(cell, values[::step]) for (cell, values), step in zip(axes, steps)]
+                shown_shape = tuple(len(values) for _, values in shown)
+                values = np.full((int(np.prod(shown_shape)), len(SWEEP_METRICS)), np.nan)
+                progress = st.progress(0.0, text=f"0 of {total:,} points")
+                chart = st.empty()
+                for chunk in chunks:
+                    index = np.unravel_index(np.arange(chunk.start, chunk.stop), shape)
+                    keep = np.logical_and.reduce([i % step == 0 for i, step in zip(index, steps)])
+                    if keep.any():
+                        target = np.ravel_multi_index([i[keep] // step for i, step in zip(index, steps)], shown_shape)
+                        values[target] = chunk.values[keep]
+                    progress.progress(chunk.stop / total, text=f"{chunk.stop:,} of {total:,} points")
+                    chart.vega_lite_chart(sweep_chart(shown, values, metric), use_container_width=True)
+
+    last_calculation = st.session_state.get("last_calculation")
+    if last_calculation is not None and st.session_state.ingredient_list:
+        sensitivity_panel(last_calculation.formulation)
+        sweep_panel(last_calculation.formulation)
+
+    # Named formulations of this session, compared side by side from one batched evaluation
+    @st.experimental_fragment
+    def saved_formulations_panel():
+        workspace = st.session_state.workspace
+        last_calculation = st.session_state.get("last_calculation")
+        with st.expander(f"🗂 Saved formulations ({len(workspace)})", expanded=False):
+            col_name, col_save = st.columns([3, 1])
+            with col_name:
+                name = st.text_input("Name", placeholder="e.g., Starter v2", key="save_name")
+            with col_save:
+                st.write("")
+                if st.button("💾 Save", disabled=last_calculation is None or not name.strip()):
+                    workspace.save(name.strip(), last_calculation.formulation)
+                    if st.session_state.get("last_stored_id") is not None:
+                        formulation_store.set_name(st.session_state.last_stored_id, name.strip())
+                    st.rerun()
+            if last_calculation is None:
+                st.caption("Calculate a formulation to save it here.")
+            if not len(workspace):
+                return
+
+            chosen = st.multiselect("Compare", workspace.names(), default=workspace.names(), key="compare_names")
+            if chosen:
+                names, outputs = workspace.compare(chosen, csv_file)
+                table = {"Output": [label for label, _ in RESULT_CELLS]}
+                for i, saved in enumerate(names):
+                    table[saved] = [None if v != v else v for v in outputs[i].tolist()]
+                st.dataframe(table, hide_index=True, use_container_width=True)
+
+            col_pick, col_load, col_delete = st.columns([2, 1, 1])
+            with col_pick:
+                picked = st.selectbox("Formulation", workspace.names(), key="saved_pick")
+            with col_load:
+                if st.button("Load"):
+                    st.session_state.load_formulation = workspace.formulation(picked)
+                    st.rerun()
+            with col_delete:
+                if st.button("Delete"):
+                    workspace.delete(picked)
+                    st.rerun()
+
+    saved_formulations_panel()
+
+    # Every formulation calculated so far (by any session), looked up by ingredient and output range
+    @st.experimental_fragment
+    def history_panel():
+        with st.expander(f"📚 Formulation history ({len(formulation_store):,} stored)", expanded=False):
+            output_labels = {cell: label for label, cell in RESULT_CELLS}
+            used = st.multiselect(
+                "Using all of", sorted(prompt_cells), format_func=lambda cell: labels.get(cell, cell), key="history_uses"
+            )
+            col_output, col_low, col_high = st.columns([2, 1, 1])
+            with col_output:
+                output = st.selectbox(
+                    "Output", [None] + [cell for _, cell in RESULT_CELLS],
+                    format_func=lambda cell: "(any)" if cell is None else output_labels[cell], key="history_output"
+                )
+            with col_low:
+                low = st.number_input("From", value=None, disabled=output is None, key="history_low")
+            with col_high:
+                high = st.number_input("To", value=None, disabled=output is None, key="history_high")
+
+            ranges = {output: (low, high)} if output is not None else {}
+            found = formulation_store.get_many(formulation_store.find(used, ranges, limit=HISTORY_ROWS))
+            if not found:
+                st.caption("No stored formulations match.")
+                return
+            shown = [cell for cell in HISTORY_OUTPUTS if cell != output] + ([output] if output else [])
+            table = {
+                "Id": [stored.id for stored in found],
+                "Saved": [stored.created.replace("T", " ") for stored in found],
+                "Name": [stored.name or "" for stored in found],
+            }
+            for cell in shown:
+                i = OUTPUT_CELLS.index(cell)
+                table[output_labels[cell]] = [None if v != v else v for v in (stored.outputs[i] for stored in found)]
+            st.dataframe(table, hide_index=True, use_container_width=True)
+            col_pick, col_load = st.columns([3, 1])
+            with col_pick:
+                picked = st.selectbox("Stored formulation", table["Id"], key="history_pick",
+                                      format_func=lambda i: f"#{i}")
+            with col_load:
+                st.write("")
+                if st.button("Load", key="history_load"):
+                    st.session_state.load_formulation = formulation_store.get(picked).formulation
+                    st.rerun()
+
+    history_panel()
+
+    # Debug panel, only when profiling is switched on with FEED_PROFILE=1
+    if PROFILER.enabled:
+        with st.expander("🛠 Profiling", expanded=False):
+            cache_stats = RESULT_CACHE.stats()
+            lookups = cache_stats["hits"] + cache_stats["misses"]
+            st.caption(
+                f"Result cache: {cache_stats['hits']} hits / {lookups} lookups"
+                + (f" ({cache_stats['hits'] / lookups:.0%})" if lookups else "")
+                + f", {cache_stats['size']} of {cache_stats['maxsize']} entries"
+            )
+            st.caption(
+                "totals_vector: every row-83 SUMPRODUCT as one matrix product; update_totals: the "
+                "rank-1 update of the previous totals after a change; formula:<cell>: one output"
+            )
+            st.table([
+                {
+                    "Name": name,
+                    "Calls": stats["calls"],
+                    "Total (ms)": f"{stats['seconds'] * 1000:.3f}",
+                    "Self (ms)": f"{stats['self_seconds'] * 1000:.3f}",
+                    "Per call (us)": f"{stats['seconds'] / stats['calls'] * 1e6:.1f}",
+                }
+                for name, stats in PROFILER.snapshot().items()
+            ])
+            metrics = prometheus_text(caches={"results": cache_stats})
+            st.download_button("Download metrics", metrics, file_name="metrics.txt", mime="text/plain")
+            if st.button("Reset counters"):
+                PROFILER.reset()
+                st.rerun()
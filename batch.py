@@ -0,0 +1,303 @@
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from calculator import INGREDIENT_CELLS
+from engine import load_nutrient_matrix
+from formulas import COST_CELLS, FORMULAS, OUTPUT_CELLS, RESULT_CELLS, TOTAL_COST
+from profiling import profiled
+from sheet import DEFAULT_CSV, load_sheet
+from store import DEFAULT_STORE, FormulationStore
+
+CHUNK_SIZE = 10000
+SHARD_SIZE = 20000     # recipes per pool task
+_COST_COLUMNS = [OUTPUT_CELLS.index(cell) for cell in COST_CELLS]
+
+
+@profiled("evaluate_batch")
+def evaluate_batch(quantities, costs=None, path=DEFAULT_CSV):
+    # quantities: N x len(INGREDIENT_CELLS), columns in INGREDIENT_CELLS order; costs: the same shape, one price row shared by
+    # every recipe, or None. Returns N x len(OUTPUT_CELLS) with NaN where the UI shows "NA".
+    quantities = np.atleast_2d(np.asarray(quantities, dtype=float))
+    n_recipes = quantities.shape[0]
+    matrix = load_nutrient_matrix(path)
+    grid = load_sheet(path).grid
+
+    columns = dict(zip(INGREDIENT_CELLS, quantities.T))
+    mix = np.column_stack([
+        columns[cell] if cell in columns else np.full(n_recipes, grid.value(cell))
+        for cell in matrix.quantity_cells
+    ])
+    totals = dict(zip(matrix.labels, (mix @ matrix.values).T))
+
+    batch_cost = batch_costs(quantities, costs)
+
+    def resolve(cell):
+        if cell == TOTAL_COST:
+            return batch_cost
+        if cell in columns:
+            return columns[cell]
+        if cell in totals:
+            return totals[cell]
+        return grid.value(cell)
+
+    values = FORMULAS.evaluate(resolve).values
+    return np.column_stack([np.broadcast_to(values[cell], (n_recipes,)) for cell in OUTPUT_CELLS])
+
+
+# Run in the pool workers
+
+def _init_worker(path):
+    # Map the compiled sheet (nutrient matrix included) once per worker; the mapping is the
+    # page-cached .npy file, so every worker reads the same physical copy
+    load_nutrient_matrix(path)
+
+
+def _evaluate_shard(shared, shape, costs, start, stop, path):
+    # Evaluate recipes start..stop of the shared quantities (and of the shared costs, when there
+    # are per-recipe costs) into the same rows of the shared results
+    blocks = {key: shared_memory.SharedMemory(name) for key, name in shared.items()}
+    try:
+        rows = slice(start, stop)
+        quantities = np.ndarray(shape, dtype=float, buffer=blocks["quantities"].buf)[rows]
+        if "costs" in blocks:
+            costs = np.ndarray(shape, dtype=float, buffer=blocks["costs"].buf)[rows]
+        results = np.ndarray((shape[0], len(OUTPUT_CELLS)), dtype=float, buffer=blocks["results"].buf)
+        results[rows] = evaluate_batch(quantities, costs, path)
+    finally:
+        # Views into the blocks have to go before the blocks can be closed
+        quantities = costs = results = None
+        for block in blocks.values():
+            block.close()
+    return stop - start
+
+
+class ParallelBatch:
+    # evaluate_batch sharded across a process pool. Recipe matrices and results travel through
+    # shared memory blocks that each task slices by row range, so nothing large is pickled and
+    # the results come back already in recipe order; the nutrient matrix is not sent at all,
+    # each worker maps it from the compiled sheet cache.
+
+    def __init__(self, path=DEFAULT_CSV, workers=None, shard_size=SHARD_SIZE):
+        self.path = os.path.abspath(path)
+        self.workers = workers or os.cpu_count() or 1
+        self.shard_size = shard_size
+        self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def start_pool(self):
+        if self.pool is None:
+            # Compile the sheet cache before the workers map it
+            load_nutrient_matrix(self.path)
+            self.pool = ProcessPoolExecutor(
+                self.workers, multiprocessing.get_context("forkserver"), _init_worker, (self.path,)
+            )
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+            self.pool = None
+
+    def evaluate(self, quantities, costs=None):
+        # Same arguments and result as evaluate_batch
+        quantities = np.atleast_2d(np.asarray(quantities, dtype=float))
+        n_recipes = quantities.shape[0]
+        if self.workers == 1 or n_recipes <= self.shard_size:
+            return evaluate_batch(quantities, costs, self.path)
+
+        per_recipe_costs = costs is not None and np.ndim(costs) == 2 and np.shape(costs)[0] == n_recipes
+        arrays = {"quantities": quantities, "results": None}
+        if per_recipe_costs:
+            arrays["costs"] = np.asarray(costs, dtype=float)
+        blocks = {}
+        try:
+            for key, array in arrays.items():
+                size = (n_recipes * len(OUTPUT_CELLS) if array is None else array.size) * 8
+                blocks[key] = shared_memory.SharedMemory(create=True, size=size)
+                if array is not None:
+                    np.ndarray(array.shape, dtype=float, buffer=blocks[key].buf)[:] = array
+            results = np.ndarray((n_recipes, len(OUTPUT_CELLS)), dtype=float, buffer=blocks["results"].buf)
+
+            self.start_pool()
+            names = {key: block.name for key, block in blocks.items()}
+            shared_costs = None if per_recipe_costs or costs is None else np.asarray(costs, dtype=float)
+            # Enough shards to keep every worker busy, none larger than shard_size
+            shard = min(self.shard_size, -(-n_recipes // self.workers))
+            futures = [
+                self.pool.submit(_evaluate_shard, names, quantities.shape, shared_costs,
+                                 start, min(n_recipes, start + shard), self.path)
+                for start in range(0, n_recipes, shard)
+            ]
+            for future in futures:
+                future.result()
+            merged = results.copy()
+            del results
+            return merged
+        finally:
+            for block in blocks.values():
+                block.close()
+                block.unlink()
+
+
+def batch_costs(quantities, costs):
+    # Cost of each recipe's batch as one dot product of its quantities with the costs (one
+    # row shared by every recipe, or one row each); NaN where an ingredient in use has no cost
+    quantities = np.atleast_2d(np.asarray(quantities, dtype=float))
+    if costs is None:
+        return np.full(quantities.shape[0], np.nan)
+    costs = np.asarray(costs, dtype=float)
+    if costs.ndim == 1 or costs.shape[0] == 1:
+        costs = costs.reshape(-1)
+        missing = ~(costs > 0)
+        total = quantities @ np.where(missing, 0.0, costs)
+        unpriced = (quantities[:, missing] > 0).any(axis=1)
+    else:
+        costs = np.broadcast_to(costs, quantities.shape)
+        priced = costs > 0
+        total = np.einsum("ij,ij->i", quantities, np.where(priced, costs, 0.0))
+        unpriced = ((quantities > 0) & ~priced).any(axis=1)
+    total[unpriced] = np.nan
+    return total
+
+
+@profiled("reprice_batch")
+def reprice_batch(quantities, costs, outputs, path=DEFAULT_CSV, out=None):
+    # outputs from evaluate_batch for the same quantities, at new costs: the nutrient columns
+    # are kept and only the COST_CELLS columns are recomputed. Written into out when given
+    # (which may be outputs itself), else into a copy.
+    outputs = np.asarray(outputs, dtype=float)
+    values = dict(zip(OUTPUT_CELLS, outputs.T))
+    batch_cost = batch_costs(quantities, costs)
+    evaluation = FORMULAS.update(values, {TOTAL_COST: batch_cost}, load_sheet(path).grid.value)
+    if out is None:
+        out = outputs.copy()
+    for i in _COST_COLUMNS:
+        out[:, i] = evaluation.values[OUTPUT_CELLS[i]]
+    return out
+
+
+def read_recipes(f, fmt):
+    # Recipe rows as dicts: ingredient cells (B2, K3, ...), optional cost_<cell> and id
+    if fmt == "jsonl":
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+    else:
+        yield from csv.DictReader(f)
+
+
+def recipe_arrays(rows):
+    quantities = np.zeros((len(rows), len(INGREDIENT_CELLS)))
+    costs = np.zeros_like(quantities)
+    for i, row in enumerate(rows):
+        for j, cell in enumerate(INGREDIENT_CELLS):
+            quantities[i, j] = float(row.get(cell) or 0)
+            costs[i, j] = float(row.get(f"cost_{cell}") or 0)
+    return quantities, costs
+
+
+def result_record(row_id, values):
+    # One recipe's outputs keyed by results-panel label, None where the UI shows "NA"
+    record = {"id": row_id}
+    record.update((label, None if value != value else value) for (label, _), value in zip(RESULT_CELLS, values))
+    return record
+
+
+def write_results(out, fmt, rows, results, header):
+    labels = [label for label, _ in RESULT_CELLS]
+    if fmt == "jsonl":
+        for i, row in enumerate(rows):
+            out.write(json.dumps(result_record(row.get("id", i), results[i].tolist())) + "\n")
+        return
+    writer = csv.writer(out)
+    if header:
+        writer.writerow(["id"] + labels)
+    for i, row in enumerate(rows):
+        writer.writerow([row.get("id", i)] + ["NA" if v != v else v for v in results[i].tolist()])
+
+
+def _chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def run(infile, outfile, in_fmt, out_fmt, path=DEFAULT_CSV, chunk_size=CHUNK_SIZE, workers=1, store=None):
+    # Stream recipes through evaluate_batch chunk by chunk; with several workers each chunk is
+    # workers x chunk_size recipes, split across the pool a chunk_size shard per task. Given a
+    # FormulationStore, every recipe is also stored, named by its id.
+    count = 0
+    with ParallelBatch(path, workers, chunk_size) as parallel:
+        for chunk in _chunks(read_recipes(infile, in_fmt), chunk_size * parallel.workers):
+            for row in chunk:
+                row.setdefault("id", count)
+                count += 1
+            quantities, costs = recipe_arrays(chunk)
+            results = parallel.evaluate(quantities, costs)
+            if store is not None:
+                names = [str(row["id"]) for row in chunk]
+                store.add_batch(quantities, costs, results, load_sheet(path).digest, names)
+            write_results(outfile, out_fmt, chunk, results, header=count == len(chunk))
+    if count == 0:
+        write_results(outfile, out_fmt, [], None, header=True)
+    return count
+
+
+def _format_for(name, fmt):
+    if fmt:
+        return fmt
+    return "jsonl" if name.endswith((".jsonl", ".json")) else "csv"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Evaluate feed formulations headless, one row per recipe.")
+    parser.add_argument("recipes", help="CSV or JSONL file of recipes, '-' for stdin")
+    parser.add_argument("-o", "--output", default="-", help="results file, '-' for stdout")
+    parser.add_argument("--input-format", choices=["csv", "jsonl"])
+    parser.add_argument("--output-format", choices=["csv", "jsonl"])
+    parser.add_argument("--sheet", default=DEFAULT_CSV, help="nutrient database CSV")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--workers", type=int, default=1, help="processes to evaluate on (0: one per CPU)")
+    parser.add_argument("--store", default=DEFAULT_STORE,
+                        help="formulation store to keep every recipe and its results in")
+    parser.add_argument("--no-store", action="store_true", help="do not store recipes")
+    args = parser.parse_args(argv)
+
+    in_fmt = _format_for(args.recipes, args.input_format)
+    out_fmt = _format_for(args.output, args.output_format)
+    infile = sys.stdin if args.recipes == "-" else open(args.recipes, newline='')
+    outfile = sys.stdout if args.output == "-" else open(args.output, "w", newline='')
+    store = None
+    if not args.no_store:
+        store = FormulationStore(args.store)
+    try:
+        count = run(infile, outfile, in_fmt, out_fmt, args.sheet, args.chunk_size, args.workers, store)
+    finally:
+        if store is not None:
+            store.close()
+        if infile is not sys.stdin:
+            infile.close()
+        if outfile is not sys.stdout:
+            outfile.close()
+    print(f"Evaluated {count} recipes", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+import argparse
+import csv
+import io
+import json
+import os
+import platform
+import resource
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from batch import ParallelBatch, evaluate_batch, reprice_batch
+from calculator import INGREDIENT_CELLS, Formulation, calculate
+from engine import load_nutrient_matrix
+from sheet import DEFAULT_CSV, SheetGrid, compile_sheet, load_sheet, read_compiled
+
+# Headless benchmarks of the calculation path. Each result is seconds per call (lower is
+# better) except peak memory, in bytes, and *_ratio results, which compare two timings.
+# Compare against a saved JSON baseline with --baseline; anything slower than
+# baseline * (1 + threshold) is flagged as a regression, as is a ratio over its limit.
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_baseline.json")
+DEFAULT_THRESHOLD = 0.2
+BATCH_SIZES = (1, 1000, 100000)
+MIN_TIME = 0.2      # seconds each timing repeat runs for
+REPEAT = 5
+# Largest allowed ratio per *_ratio result, baseline or not: an incremental Calculate after
+# one quantity change must not be slower than a full one
+RATIO_LIMITS = {"incremental_ratio": 1.0}
+
+
+def measure(func, min_time=MIN_TIME, repeat=REPEAT):
+    # Best of repeat runs of the mean seconds per call, calls per run sized to last min_time
+    calls = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(calls):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time / 10 or calls >= 1 << 20:
+            break
+        calls *= 10
+    calls = max(1, int(calls * min_time / max(elapsed, 1e-9)))
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(calls):
+            func()
+        best = min(best, (time.perf_counter() - start) / calls)
+    return best
+
+
+def measure_interleaved(funcs, min_time=MIN_TIME, repeat=REPEAT):
+    # measure() for several funcs with their repeats interleaved, so a ratio between them
+    # is not skewed by the machine getting busier between one and the next
+    best = [float("inf")] * len(funcs)
+    for _ in range(repeat):
+        for i, func in enumerate(funcs):
+            best[i] = min(best[i], measure(func, min_time / repeat, 1))
+    return best
+
+
+def random_recipes(n, seed=0):
+    # n recipes using about a third of the ingredients each, with costs for all of them
+    rng = np.random.default_rng(seed)
+    quantities = rng.uniform(0, 100, (n, len(INGREDIENT_CELLS)))
+    quantities[rng.random(quantities.shape) > 0.3] = 0.0
+    costs = rng.uniform(1, 100, len(INGREDIENT_CELLS))
+    return quantities, costs
+
+
+def formulation_from(quantities, costs):
+    used = {cell: float(q) for cell, q in zip(INGREDIENT_CELLS, quantities) if q > 0}
+    return Formulation(used, {cell: float(c) for cell, c in zip(INGREDIENT_CELLS, costs) if cell in used})
+
+
+def run_benchmarks(path=DEFAULT_CSV, batch_sizes=BATCH_SIZES, workers=1):
+    results = {}
+    path = os.path.abspath(path)
+    with open(path, "rb") as f:
+        data = f.read()
+
+    # Loading: parsing the CSV text, mapping the compiled cache, and the per-process cached lookup
+    def parse():
+        reader = csv.reader(io.TextIOWrapper(io.BytesIO(data), newline=''))
+        return SheetGrid.from_rows(tuple(tuple(row) for row in reader))
+
+    _, digest = compile_sheet(path, data)
+    results["csv_parse"] = measure(parse)
+    if read_compiled(path, digest) is not None:
+        results["cache_mmap_load"] = measure(lambda: read_compiled(path, digest))
+    results["load_sheet_cached"] = measure(lambda: load_sheet(path))
+
+    quantities, costs = random_recipes(max(batch_sizes))
+    formulation = formulation_from(quantities[0], costs)
+    other = formulation_from(quantities[-1], costs)
+    matrix = load_nutrient_matrix(path)
+
+    # One full evaluation of all outputs, uncached, then one after a single quantity change
+    previous = calculate(formulation, path, cache=None)
+    cell = next(iter(formulation.quantities))
+    quantities_changed = dict(formulation.quantities)
+    quantities_changed[cell] += 1
+    changed = Formulation(quantities_changed, formulation.costs)
+    results["full_evaluation"], results["incremental_evaluation"] = measure_interleaved([
+        lambda: calculate(formulation, path, cache=None),
+        lambda: calculate(changed, path, previous, cache=None),
+    ], repeat=3 * REPEAT)
+    results["incremental_ratio"] = results["incremental_evaluation"] / results["full_evaluation"]
+    results["cached_evaluation"] = measure(lambda: calculate(other, path))
+
+    # One totals-row SUMPRODUCT (C83: a composition column dotted with the quantities), all
+    # of them as one product, and a cell read
+    context = previous.context
+    quantities_vector = np.asarray(previous.quantities, dtype=float)
+    column = np.ascontiguousarray(matrix.values[:, 0])
+    results["sumproduct"] = measure(lambda: quantities_vector @ column)
+    results["totals_product"] = measure(lambda: matrix.totals_vector(previous.quantities))
+    results["get_cell_value"] = measure(lambda: context.get_cell_value("H21"))
+
+    for n in batch_sizes:
+        block = quantities[:n]
+        repeat = 3 if n > 1000 else REPEAT
+        results[f"batch_{n}"] = measure(lambda: evaluate_batch(block, costs, path), repeat=repeat)
+
+    # The largest batch again at new prices, reusing its nutrient outputs
+    outputs = evaluate_batch(quantities, costs, path)
+    new_costs = costs * 1.05
+    results[f"reprice_batch_{len(quantities)}"] = measure(lambda: reprice_batch(quantities, new_costs, outputs, path), repeat=3)
+
+    # The largest batch sharded across a process pool (pool already started, as in a nightly run)
+    if workers != 1:
+        with ParallelBatch(path, workers) as parallel:
+            parallel.start_pool()
+            parallel.evaluate(quantities, costs)
+            results[f"parallel_batch_{len(quantities)}"] = measure(lambda: parallel.evaluate(quantities, costs), repeat=3)
+
+    # Peak Python allocations while evaluating the largest batch, and the process high-water mark
+    tracemalloc.start()
+    evaluate_batch(quantities, costs, path)
+    results["batch_peak_bytes"] = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    results["max_rss_bytes"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return results
+
+
+def describe(name, value):
+    if name.endswith("_bytes"):
+        return f"{value / 2 ** 20:10.1f} MiB"
+    if name.endswith("_ratio"):
+        return f"{value:10.2f} x"
+    text = f"{value * 1e6:10.2f} us" if value < 1e-2 else f"{value * 1e3:10.2f} ms"
+    if "batch_" in name:
+        n = int(name.rsplit("_", 1)[1])
+        text += f"  ({n / value:,.0f} recipes/s)"
+    return text
+
+
+def compare(results, baseline, threshold):
+    # (name, ratio to baseline) for each result slower or larger than the threshold allows,
+    # and (name, ratio to limit) for each *_ratio over its RATIO_LIMITS entry
+    regressions = []
+    for name, value in results.items():
+        base = baseline.get(name)
+        if name in RATIO_LIMITS and value > RATIO_LIMITS[name]:
+            regressions.append((name, value / RATIO_LIMITS[name]))
+        elif base and value > base * (1 + threshold):
+            regressions.append((name, value / base))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the formulation engine headless.")
+    parser.add_argument("--sheet", default=DEFAULT_CSV, help="nutrient database CSV")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="baseline JSON to compare against")
+    parser.add_argument("--save", action="store_true", help="write these results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="allowed slowdown before flagging, as a fraction (0.2 = 20%%)")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=list(BATCH_SIZES))
+    parser.add_argument("--workers", type=int, default=1,
+                        help="also time the largest batch on this many processes (0: one per CPU)")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.sheet, args.batch_sizes, args.workers)
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+    regressions = dict(compare(results, baseline, args.threshold))
+
+    for name, value in results.items():
+        line = f"{name:24} {describe(name, value)}"
+        if name in baseline:
+            line += f"  x{value / baseline[name]:.2f} vs baseline"
+        if name in regressions:
+            line += "  REGRESSION"
+        print(line)
+
+    report = {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "results": results,
+    }
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.save:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Saved baseline to {args.baseline}")
+    elif regressions:
+        print(f"{len(regressions)} regression(s) beyond {args.threshold:.0%} or a ratio limit", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,193 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict, namedtuple
+from types import MappingProxyType
+
+from engine import nutrient_matrix_for
+from formulas import FORMULAS, NA, TOTAL_COST, results_from
+from profiling import PROFILER, profiled
+from schema import SCHEMA
+from sheet import DEFAULT_CSV, load_sheet
+
+# Cells a formulation sets, in schema order: feed ingredients B2-B31 then additives K2-K15
+INGREDIENT_CELLS = list(SCHEMA.ingredient_cells)
+RESULT_CACHE_SIZE = 256
+
+
+class Formulation:
+    # One ration: quantity and cost per kg for each ingredient cell it uses (read-only copies),
+    # and the price-list version the costs came from, if any
+
+    def __init__(self, quantities, costs=None, price_version=None):
+        self.quantities = MappingProxyType(dict(quantities))
+        self.costs = MappingProxyType(dict(costs or {}))
+        self.price_version = price_version
+
+    @classmethod
+    def from_ingredient_list(cls, ingredient_list, price_version=None):
+        # From the UI's {cell: {'name', 'quantity', 'cost'}} mapping
+        return cls(
+            {cell: data['quantity'] for cell, data in ingredient_list.items()},
+            {cell: data.get('cost', 0) for cell, data in ingredient_list.items()},
+            price_version,
+        )
+
+    def total_cost(self):
+        # Cost of the whole batch, NA if any ingredient lacks cost data
+        for cell in self.quantities:
+            if self.costs.get(cell, 0) <= 0:
+                return NA
+        total = 0
+        for cell, qty in self.quantities.items():
+            total += qty * self.costs[cell]
+        return total
+
+    def fingerprint(self):
+        # Canonical hash of the quantities, the costs that apply to them and their price version
+        canonical = sorted((cell, float(qty), float(self.costs.get(cell, 0))) for cell, qty in self.quantities.items())
+        if self.price_version is not None:
+            canonical.append(self.price_version)
+        return hashlib.sha256(json.dumps(canonical).encode()).hexdigest()
+
+
+class CalculationContext(namedtuple("CalculationContext", "grid cells")):
+    # Immutable inputs of one calculation: ingredient quantities, batch cost and row-83 totals
+    # on top of the shared read-only sheet grid. Nothing here is visible to other sessions.
+
+    __slots__ = ()
+
+    def __new__(cls, grid, cells):
+        return super().__new__(cls, grid, MappingProxyType(dict(cells)))
+
+    def get_cell_value(self, cell):
+        value = self.cells.get(cell)
+        return self.grid.value(cell) if value is None else value
+
+
+class Calculation(namedtuple("Calculation", "formulation matrix quantities totals context evaluation results")):
+    # Outcome of calculate(); pass it back as previous to recalculate incrementally
+
+    __slots__ = ()
+
+
+class ResultCache:
+    # Process-wide LRU of Calculations keyed by (sheet content hash, formulation fingerprint)
+
+    def __init__(self, maxsize=RESULT_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            calculation = self._entries.get(key)
+            if calculation is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._entries.move_to_end(key)
+            return calculation
+
+    def put(self, key, calculation):
+        with self._lock:
+            self._entries[key] = calculation
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+            }
+
+
+RESULT_CACHE = ResultCache()
+
+
+@profiled("calculate")
+def calculate(formulation, path=DEFAULT_CSV, previous=None, cache=RESULT_CACHE):
+    # Evaluate every output for formulation against the sheet at path. A formulation seen
+    # before on the same sheet contents is served from cache; otherwise, given the previous
+    # Calculation on the same sheet, only the changed ingredients and outputs are recomputed.
+    loaded = load_sheet(path)
+    if cache is not None:
+        key = (loaded.digest, formulation.fingerprint())
+        calculation = cache.get(key)
+        if calculation is not None:
+            return calculation
+
+    matrix = nutrient_matrix_for(loaded)
+    grid = loaded.grid
+    if previous is not None and previous.matrix is not matrix:
+        previous = None
+    if previous is not None and previous.formulation.quantities == formulation.quantities:
+        calculation = _repriced(previous, formulation)
+        if cache is not None:
+            cache.put(key, calculation)
+        return calculation
+
+    cells = {cell: formulation.quantities.get(cell, 0.0) for cell in INGREDIENT_CELLS}
+    cells[TOTAL_COST] = formulation.total_cost()
+
+    # All row-83 sumproducts (C83, F83, ... AS83) from one quantities @ matrix product, or
+    # a rank-1 update of the previous totals per changed ingredient quantity
+    quantities = tuple(cells[cell] if cell in cells else grid.value(cell) for cell in matrix.quantity_cells)
+    if previous is None:
+        totals = matrix.totals_vector(quantities)
+    else:
+        totals = matrix.update_totals(previous.totals, previous.quantities, quantities)
+    totals.setflags(write=False)
+    cells.update(zip(matrix.labels, totals.tolist()))
+
+    context = CalculationContext(grid, cells)
+    with PROFILER.timer("evaluate"):
+        resolve = PROFILER.wrap("get_cell_value", context.get_cell_value)
+        if previous is None:
+            evaluation = FORMULAS.evaluate(resolve)
+        else:
+            # Same sheet, so only the cells set here can differ from the previous pass
+            before = previous.context.cells
+            changes = {cell: value for cell, value in cells.items() if before.get(cell) != value}
+            evaluation = FORMULAS.update(previous.evaluation.values, changes, resolve)
+    results = MappingProxyType(results_from(evaluation))
+    calculation = Calculation(formulation, matrix, quantities, totals, context, evaluation, results)
+    if cache is not None:
+        cache.put(key, calculation)
+    return calculation
+
+
+def _repriced(previous, formulation):
+    # previous with formulation's costs: same quantities, so the totals and every nutrient
+    # output carry over and only the batch cost and the outputs reading it are recomputed
+    with PROFILER.timer("reprice"):
+        batch_cost = formulation.total_cost()
+        cells = dict(previous.context.cells)
+        cells[TOTAL_COST] = batch_cost
+        context = CalculationContext(previous.context.grid, cells)
+        evaluation = FORMULAS.update(previous.evaluation.values, {TOTAL_COST: batch_cost}, context.get_cell_value)
+        results = MappingProxyType(results_from(evaluation))
+    return Calculation(formulation, previous.matrix, previous.quantities, previous.totals, context, evaluation, results)
+
+
+def reprice(calculation, costs, path=DEFAULT_CSV, cache=RESULT_CACHE):
+    # calculation's formulation at new ingredient costs ({cell: cost per kg})
+    return calculate(Formulation(calculation.formulation.quantities, costs), path, calculation, cache)
+
+
+def reprice_to(calculation, table, path=DEFAULT_CSV, cache=RESULT_CACHE):
+    # calculation's formulation at the costs of a price-list version (a prices.PriceTable)
+    return calculate(table.formulation(calculation.formulation.quantities), path, calculation, cache)
@@ -0,0 +1,84 @@
+import threading
+
+import numpy as np
+
+from profiling import profiled
+from schema import SCHEMA
+from sheet import load_sheet
+
+# Quantities (B2-B41) multiply the composition table (rows 43-82, named in row 42); the
+# totals row (83) holds the sums. The layout comes from schema.json.
+QUANTITY_CELLS = list(SCHEMA.quantity_cells)
+NUTRIENT_ROWS = SCHEMA.table_rows
+TOTALS_ROW = SCHEMA.totals_row
+FIRST_NUTRIENT_COL = SCHEMA.nutrient_columns[0]
+LAST_NUTRIENT_COL = SCHEMA.nutrient_columns[-1]
+# Beyond this many changed quantities a full product is cheaper than rank-1 updates
+MAX_INCREMENTAL_CHANGES = 10
+# An updated total this small next to the terms that produced it has cancelled, and holds
+# only rounding residue; that total is then recomputed from the quantities
+CANCELLATION = 1e-9
+
+
+class NutrientMatrix:
+    # Dense ingredients x nutrients matrix of the composition table, read once from the sheet
+
+    def __init__(self, grid):
+        self.columns = list(SCHEMA.nutrient_columns)
+        self.quantity_cells = list(QUANTITY_CELLS)
+        self.labels = [f"{col}{TOTALS_ROW}" for col in self.columns]
+        self.index = {label: i for i, label in enumerate(self.labels)}
+        # Nutrient names from the table's header row, e.g. "C83" -> "CP"
+        self.names = {}
+        for col, label in zip(self.columns, self.labels):
+            self.names[label] = grid.text(f"{col}{SCHEMA.header_row}") or label
+        self.values = grid.block(
+            f"{FIRST_NUTRIENT_COL}{NUTRIENT_ROWS[0]}", f"{LAST_NUTRIENT_COL}{NUTRIENT_ROWS[-1]}"
+        )
+        self.values.setflags(write=False)   # shared by every session
+
+    @profiled("totals_vector")
+    def totals_vector(self, quantities):
+        # Every row-83 SUMPRODUCT in one product
+        return np.asarray(quantities, dtype=float) @ self.values
+
+    def totals(self, quantities):
+        return dict(zip(self.labels, self.totals_vector(quantities).tolist()))
+
+    @profiled("update_totals")
+    def update_totals(self, totals, old_quantities, new_quantities):
+        # Previous totals plus delta_qty x nutrient row for each ingredient whose quantity changed
+        changed = [i for i, (old, new) in enumerate(zip(old_quantities, new_quantities)) if old != new]
+        if len(changed) > MAX_INCREMENTAL_CHANGES:
+            return self.totals_vector(new_quantities)
+        if len(changed) == 1:
+            i = changed[0]
+            delta = (float(new_quantities[i]) - float(old_quantities[i])) * self.values[i]
+        else:
+            steps = [float(new_quantities[i]) - float(old_quantities[i]) for i in changed]
+            delta = np.dot(steps, self.values[changed]) if changed else np.zeros_like(totals)
+        updated = totals + delta
+        # Only totals the change touched can have cancelled; recompute just those columns
+        cancelled = (delta != 0) & (np.abs(updated) <= CANCELLATION * (np.abs(totals) + np.abs(delta)))
+        if cancelled.any():
+            updated[cancelled] = np.asarray(new_quantities, dtype=float) @ self.values[:, cancelled]
+        return updated
+
+
+_matrix_cache = {}     # sheet digest -> NutrientMatrix
+_matrix_lock = threading.Lock()
+
+def load_nutrient_matrix(path):
+    # Shared read-only matrix for the current contents of the sheet at path
+    return nutrient_matrix_for(load_sheet(path))
+
+def nutrient_matrix_for(loaded):
+    matrix = _matrix_cache.get(loaded.digest)
+    if matrix is None:
+        with _matrix_lock:
+            matrix = _matrix_cache.get(loaded.digest)
+            if matrix is None:
+                matrix = NutrientMatrix(loaded.grid)
+                _matrix_cache.clear()
+                _matrix_cache[loaded.digest] = matrix
+    return matrix
@@ -0,0 +1,269 @@
+from types import MappingProxyType
+
+import numpy as np
+
+from engine import QUANTITY_CELLS
+from profiling import PROFILER
+from schema import SCHEMA
+
+TOTAL_COST = "total_cost"   # leaf: cost of the whole batch, NaN if an ingredient lacks cost data
+NA = float("nan")           # shown as "NA" in results
+MAX_DEPENDENT_SETS = 256    # sets of changed leaves whose dependents FormulaGraph keeps
+
+
+class FormulaCycleError(ValueError):
+    pass
+
+
+class Formula:
+    def __init__(self, cell, inputs, func):
+        self.cell = cell
+        self.inputs = inputs
+        self.func = func
+
+
+class Evaluation:
+    # Read-only values of every leaf and formula cell from one pass, plus how often each formula ran
+
+    def __init__(self, values, counts):
+        self.values = MappingProxyType(values)
+        self.counts = MappingProxyType(counts)
+
+
+class FormulaGraph:
+    # Output cells declare the cells they read; evaluate() runs each one once in dependency order
+
+    def __init__(self):
+        self.formulas = {}
+        self._order = None
+        self._leaves = None
+        self._readers = None
+        self._dependents = {}   # frozenset of changed cells -> formulas downstream of them
+
+    def formula(self, cell, *inputs):
+        def register(func):
+            if cell in self.formulas:
+                raise ValueError(f"Formula for {cell} is already defined")
+            self.formulas[cell] = Formula(cell, inputs, func)
+            self._order = self._leaves = self._readers = None
+            self._dependents = {}
+            return func
+        return register
+
+    def leaves(self):
+        if self._leaves is None:
+            self._leaves = sorted({
+                name for f in self.formulas.values() for name in f.inputs if name not in self.formulas
+            })
+        return self._leaves
+
+    def dependents(self, cells):
+        # Formulas that read any of cells, directly or through other formulas. The same few
+        # sets of changed leaves recur (one ingredient and the totals it feeds), so results
+        # are kept per set.
+        key = frozenset(cells)
+        found = self._dependents.get(key)
+        if found is None:
+            if len(self._dependents) >= MAX_DEPENDENT_SETS:
+                self._dependents.clear()
+            found = self._dependents[key] = frozenset(self._find_dependents(key))
+        return found
+
+    def _find_dependents(self, cells):
+        if self._readers is None:
+            readers = {}
+            for f in self.formulas.values():
+                for name in f.inputs:
+                    readers.setdefault(name, []).append(f.cell)
+            self._readers = readers
+        found = set()
+        pending = list(cells)
+        while pending:
+            for reader in self._readers.get(pending.pop(), ()):
+                if reader not in found:
+                    found.add(reader)
+                    pending.append(reader)
+        return found
+
+    def order(self):
+        if self._order is None:
+            self._order = self._topological_order()
+        return self._order
+
+    def _topological_order(self):
+        order = []
+        state = {}   # cell -> "visiting" while on the DFS stack, "done" once emitted
+        for root in self.formulas:
+            if root in state:
+                continue
+            stack = [(root, iter(self.formulas[root].inputs))]
+            state[root] = "visiting"
+            while stack:
+                cell, inputs = stack[-1]
+                for name in inputs:
+                    if name not in self.formulas:
+                        continue
+                    if state.get(name) == "visiting":
+                        path = [c for c, _ in stack]
+                        cycle = path[path.index(name):] + [name]
+                        raise FormulaCycleError("Circular reference: " + " -> ".join(cycle))
+                    if name not in state:
+                        state[name] = "visiting"
+                        stack.append((name, iter(self.formulas[name].inputs)))
+                        break
+                else:
+                    stack.pop()
+                    state[cell] = "done"
+                    order.append(cell)
+        return order
+
+    def evaluate(self, resolve, previous=None):
+        # resolve(cell) supplies leaf inputs; each leaf is resolved at most once. Given the
+        # previous Evaluation, only formulas downstream of leaves whose value changed are rerun.
+        if previous is None:
+            return self._run({}, None, resolve)
+        values = dict(previous.values)
+        changed = []
+        for name in self.leaves():
+            value = resolve(name)
+            if name not in values or values[name] != value:
+                values[name] = value
+                changed.append(name)
+        return self._run(values, self.dependents(changed), resolve)
+
+    def update(self, values, changes, resolve):
+        # Rerun only the formulas downstream of the leaves in changes ({cell: new value}), on
+        # top of values from an earlier pass (an Evaluation's, or any cell -> value mapping).
+        # resolve(cell) supplies leaves missing from values.
+        values = dict(values)
+        values.update(changes)
+        dirty = self.dependents(changes)
+        if any(cell not in values and cell not in dirty for cell in self.formulas):
+            for cell in dirty:
+                for name in self.formulas[cell].inputs:
+                    if name in self.formulas and name not in dirty and name not in values:
+                        raise KeyError(f"{cell} reads {name}, which has no earlier value")
+        return self._run(values, dirty, resolve)
+
+    def _run(self, values, dirty, resolve):
+        # Run the formulas in dirty (all of them when None) in dependency order into values
+        counts = dict.fromkeys(self.formulas, 0)
+        profiling = PROFILER.enabled
+        for cell in self.order():
+            if dirty is not None and cell not in dirty:
+                continue
+            formula = self.formulas[cell]
+            args = []
+            for name in formula.inputs:
+                if name not in values:
+                    values[name] = resolve(name)
+                args.append(values[name])
+            if profiling:
+                values[cell] = PROFILER.call(f"formula:{cell}", formula.func, *args)
+            else:
+                values[cell] = formula.func(*args)
+            counts[cell] += 1
+        return Evaluation(values, counts)
+
+# Formulas take floats for a single formulation or arrays with one entry per recipe
+
+def ratio(numerator, denominator):
+    if np.ndim(denominator):
+        shape = np.broadcast(numerator, denominator).shape
+        return np.divide(numerator, denominator, out=np.zeros(shape), where=denominator != 0)
+    return numerator / denominator if denominator != 0 else 0.0
+
+
+FORMULAS = FormulaGraph()
+formula = FORMULAS.formula
+
+
+@formula("F1", *QUANTITY_CELLS)
+def total_quantity(*quantities):
+    total = 0
+    for qty in quantities:
+        total += qty
+    return total
+
+
+def linear(weights):
+    # sum of weight * input, inputs in the order of weights
+    weights = tuple(weights)
+
+    def combine(*values):
+        total = 0
+        for weight, value in zip(weights, values):
+            total += weight * value
+        return total
+    return combine
+
+
+def per_kg(weights):
+    combine = linear(weights)
+    return lambda *values: ratio(combine(*values[:-1]), values[-1])
+
+
+# Outputs the schema defines as weighted sums of totals-row and additive cells, per kg of batch or as is
+for _cell, _terms, _per_kg in zip(SCHEMA.output_cells, SCHEMA.output_terms, SCHEMA.output_per_kg):
+    if _terms is None:
+        continue
+    if _per_kg:
+        formula(_cell, *_terms, "F1")(per_kg(_terms.values()))
+    else:
+        formula(_cell, *_terms)(linear(_terms.values()))
+del _cell, _terms, _per_kg
+
+# Outputs derived from other outputs
+formula("F4", "F3", "F2")(lambda f3, f2: ratio(f3, f2) * 1000)
+formula("F9", "F7", "F8")(lambda f7, f8: f7 + f8)
+formula("F17", "F24")(lambda f24: f24 / 10)
+formula("F18", "F25")(lambda f25: f25 / 10)
+formula("F19", "F26")(lambda f26: f26 / 10)
+formula("F16", "F26", "F25")(ratio)
+formula("F15", "F17", "F18")(ratio)
+formula("F14", "F25", "F26", "F24")(lambda f25, f26, f24: (f25 / 23 + f26 / 39 - f24 / 35) * 100)
+
+
+@formula("F20", TOTAL_COST, "F1")
+def cost_per_kg(batch_cost, total_quantity):
+    # NA when an ingredient lacks cost data or the batch is empty
+    if np.ndim(total_quantity):
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(total_quantity != 0, batch_cost / total_quantity, NA)
+    return batch_cost / total_quantity if total_quantity != 0 else NA
+
+
+formula("F21", "F20")(lambda f20: f20 * 75)
+formula("F22", "H21", "F21")(lambda h21, f21: h21 - f21)
+
+# Worksheet helpers outside the results panel
+formula("M2", "K2", "L2")(lambda k2, l2: k2 * l2 / 1000)
+formula("M25", "K25", "L25")(lambda k25, l25: k25 * l25 / 1000)
+formula("M26", *[f"M{r}" for r in range(2, 26)])(lambda *m: sum(m))
+formula("T18", "T16", "T17")(lambda t16, t17: t16 + t17)
+formula("Z19", *[f"Z{r}" for r in range(2, 19)])(lambda *z: ratio(sum(z[:-1]), z[-1]))
+
+# Results panel rows in display order
+RESULT_CELLS = list(zip(SCHEMA.output_labels, SCHEMA.output_cells))
+OUTPUT_CELLS = [cell for _, cell in RESULT_CELLS]
+for _cell in OUTPUT_CELLS:
+    if _cell not in FORMULAS.formulas:
+        raise ValueError(f"Schema output {_cell} has no formula")
+del _cell
+
+# Build the evaluation order and reader index up front so concurrent sessions only read them
+FORMULAS.order()
+FORMULAS.leaves()
+FORMULAS.dependents(())
+
+# Outputs a price change touches (cost per kg, per bag, margin); everything else depends
+# only on quantities and the sheet
+COST_CELLS = [cell for cell in OUTPUT_CELLS if cell in FORMULAS.dependents([TOTAL_COST])]
+
+
+def results_from(evaluation):
+    results = {}
+    for label, cell in RESULT_CELLS:
+        value = evaluation.values[cell]
+        results[label] = "NA" if value != value else value
+    return results
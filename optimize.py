@@ -0,0 +1,275 @@
+import numpy as np
+
+try:
+    from scipy.optimize import linprog as _scipy_linprog
+except ImportError:     # scipy is optional: without it the built-in simplex below is used
+    _scipy_linprog = None
+
+# Least-cost formulation: minimise ingredient cost for a fixed batch size subject to the
+# nutrient Max/Min rows (G/H 2-19) and the per-ingredient Max/Min columns (C/D 2-31).
+# A Max or Min of 0 in the sheet means the limit is not set.
+
+INGREDIENT_MAX_COL = "C"
+INGREDIENT_MIN_COL = "D"
+NUTRIENT_NAME_COL = "E"
+NUTRIENT_MAX_COL = "G"
+NUTRIENT_MIN_COL = "H"
+DEFAULT_BATCH_SIZE = 1000.0
+TOL = 1e-9
+PIVOT_TOL = 1e-7            # smallest pivot element the simplex will divide by (rows scaled to 1)
+FEASIBILITY_TOL = 1e-7      # relative constraint violation a returned mix may have
+DEGENERATE_PIVOTS = 20      # degenerate pivots in a row before the simplex falls back to Bland's rule
+
+# Each limited output as numerator / denominator, both linear in the quantities:
+# {total cell: weight}, with "F1" standing for the total quantity
+NUTRIENT_FORMS = {
+    "F2": ({"C83": 1}, {"F1": 1}),
+    "F3": ({"F83": 1}, {"F1": 1}),
+    "F4": ({"F83": 1000}, {"C83": 1}),
+    "F5": ({"D83": 1}, {"F1": 1}),
+    "F6": ({"J83": 1}, {"F1": 1}),
+    "F7": ({"K83": 1}, {"F1": 1}),
+    "F8": ({"L83": 1}, {"F1": 1}),
+    "F9": ({"K83": 1, "L83": 1}, {"F1": 1}),
+    "F10": ({"M83": 1}, {"F1": 1}),
+    "F11": ({"G83": 1}, {"F1": 1}),
+    "F12": ({"H83": 1}, {"F1": 1}),
+    "F13": ({"I83": 1}, {"F1": 1}),
+    "F14": ({"X83": 100 / 23, "Y83": 100 / 39, "W83": -100 / 35}, {"F1": 1}),
+    "F15": ({"W83": 1}, {"X83": 1}),
+    "F16": ({"Y83": 1}, {"X83": 1}),
+    "F17": ({"W83": 1}, {"F1": 10}),
+    "F18": ({"X83": 1}, {"F1": 10}),
+    "F19": ({"Y83": 1}, {"F1": 10}),
+}
+
+
+class InfeasibleFormulation(ValueError):
+    pass
+
+
+class SolverFailed(InfeasibleFormulation):
+    # The solver stopped (pivot limit, numerical trouble) without deciding either way
+    pass
+
+
+def ingredient_bounds(grid, cell):
+    row = int(cell[1:])
+    low = grid.value(f"{INGREDIENT_MIN_COL}{row}")
+    high = grid.value(f"{INGREDIENT_MAX_COL}{row}")
+    return max(low, 0.0), (high if high > 0 else np.inf)
+
+
+def nutrient_limits(grid):
+    # (output cell, sheet name, min, max) for every nutrient row with a limit set
+    limits = []
+    for cell in NUTRIENT_FORMS:
+        row = int(cell[1:])
+        low = grid.value(f"{NUTRIENT_MIN_COL}{row}")
+        high = grid.value(f"{NUTRIENT_MAX_COL}{row}")
+        if low > 0 or high > 0:
+            limits.append((cell, grid.text(f"{NUTRIENT_NAME_COL}{row}"), low if low > 0 else None, high if high > 0 else None))
+    return limits
+
+
+def _linear_form(matrix, rows, weights):
+    vector = np.zeros(len(rows))
+    for total, weight in weights.items():
+        if total == "F1":
+            vector += weight
+        else:
+            vector += weight * matrix.values[rows, matrix.index[total]]
+    return vector
+
+
+def least_cost(matrix, grid, costs, batch_size=DEFAULT_BATCH_SIZE):
+    # costs: {ingredient cell: cost per kg} for the B2-B31 ingredients the solver may use.
+    # Returns {cell: quantity} for the cheapest mix of batch_size kg meeting every limit.
+    if not costs:
+        raise InfeasibleFormulation("Select at least one feed ingredient to optimize")
+    cells = sorted(costs, key=lambda cell: int(cell[1:]))
+    missing = [cell for cell in cells if costs[cell] <= 0]
+    if missing:
+        raise InfeasibleFormulation(f"Enter a cost for {', '.join(missing)} before optimizing")
+    rows = [matrix.quantity_cells.index(cell) for cell in cells]
+
+    a_ub, b_ub = [], []
+    for cell, name, low, high in nutrient_limits(grid):
+        numerator, denominator = NUTRIENT_FORMS[cell]
+        n = _linear_form(matrix, rows, numerator)
+        d = _linear_form(matrix, rows, denominator)
+        if low is not None:
+            a_ub.append(low * d - n)
+            b_ub.append(0.0)
+        if high is not None:
+            a_ub.append(n - high * d)
+            b_ub.append(0.0)
+
+    bounds = [ingredient_bounds(grid, cell) for cell in cells]
+    x = linprog(
+        np.array([costs[cell] for cell in cells], dtype=float),
+        a_ub, b_ub,
+        np.ones((1, len(cells))), [float(batch_size)],
+        bounds,
+    )
+    if x is None:
+        raise InfeasibleFormulation(
+            "No formulation of the selected ingredients meets every nutrient and ingredient limit"
+        )
+    return {cell: float(q) for cell, q in zip(cells, x)}
+
+
+def linprog(c, a_ub, b_ub, a_eq, b_eq, bounds):
+    # min c.x  s.t.  a_ub x <= b_ub, a_eq x = b_eq, low <= x <= high. Solved by HiGHS when scipy
+    # is installed, else by the simplex below; returns None when infeasible. Whatever solves it,
+    # x is checked against every constraint before it is returned.
+    n = len(c)
+    c = np.asarray(c, dtype=float)
+    a_ub = np.array(a_ub, dtype=float).reshape(-1, n)
+    a_eq = np.array(a_eq, dtype=float).reshape(-1, n)
+    b_ub = np.array(b_ub, dtype=float)
+    b_eq = np.array(b_eq, dtype=float)
+    low = np.array([b[0] for b in bounds], dtype=float)
+    high = np.array([b[1] for b in bounds], dtype=float)
+    if np.any(low > high + TOL * np.maximum(1.0, np.abs(low))):
+        return None
+
+    solve = _highs if _scipy_linprog is not None else simplex
+    x = solve(c, a_ub, b_ub, a_eq, b_eq, low, high)
+    if x is None or not _feasible(x, a_ub, b_ub, a_eq, b_eq, low, high):
+        return None
+    return np.clip(x, low, high)
+
+
+def _feasible(x, a_ub, b_ub, a_eq, b_eq, low, high):
+    # Residuals measured against the size of the terms in each row
+    def slack(a, b):
+        return FEASIBILITY_TOL * np.maximum(1.0, np.abs(a) @ np.abs(x) + np.abs(b))
+
+    return bool(
+        np.all(np.isfinite(x))
+        and np.all(a_ub @ x <= b_ub + slack(a_ub, b_ub))
+        and np.all(np.abs(a_eq @ x - b_eq) <= slack(a_eq, b_eq))
+        and np.all(x >= low - FEASIBILITY_TOL * np.maximum(1.0, np.abs(low)))
+        and np.all(x <= high + FEASIBILITY_TOL * np.maximum(1.0, np.abs(high)))
+    )
+
+
+def _highs(c, a_ub, b_ub, a_eq, b_eq, low, high):
+    result = _scipy_linprog(
+        c, A_ub=a_ub if len(a_ub) else None, b_ub=b_ub if len(a_ub) else None,
+        A_eq=a_eq if len(a_eq) else None, b_eq=b_eq if len(a_eq) else None,
+        bounds=list(zip(low, np.where(np.isfinite(high), high, None))), method="highs",
+    )
+    if result.status == 0:
+        return result.x
+    if result.status in (2, 3):     # infeasible, unbounded
+        return None
+    raise SolverFailed(f"The optimizer stopped without an answer: {result.message}")
+
+
+def simplex(c, a_ub, b_ub, a_eq, b_eq, low, high, max_pivots=None):
+    # Dense two-phase simplex; returns None when infeasible or unbounded and raises SolverFailed
+    # after max_pivots pivots (default: 50 per row and column).
+    n = len(c)
+
+    # Shift to y = x - low >= 0 and turn finite upper bounds into rows
+    capped = np.flatnonzero(np.isfinite(high))
+    b_ub = np.concatenate([b_ub - a_ub @ low, (high - low)[capped]])
+    a_ub = np.vstack([a_ub, np.eye(n)[capped]])
+    b_eq = b_eq - a_eq @ low
+    a_eq = a_eq.copy()
+    if np.any(b_ub[len(b_ub) - len(capped):] < -TOL):
+        return None
+
+    # Scale rows so the tolerances mean the same for every constraint
+    for a, b in ((a_ub, b_ub), (a_eq, b_eq)):
+        scale = np.abs(a).max(axis=1, initial=0.0)
+        scale[scale == 0] = 1.0
+        a /= scale[:, None]
+        b /= scale
+
+    m_ub, m_eq = len(b_ub), len(b_eq)
+    m = m_ub + m_eq
+    if max_pivots is None:
+        max_pivots = 50 * (m + n + m_ub)
+    # Columns: y (n) | slacks (m_ub) | artificials (m) | rhs
+    t = np.zeros((m + 1, n + m_ub + m + 1))
+    t[:m_ub, :n] = a_ub
+    t[:m_ub, n:n + m_ub] = np.eye(m_ub)
+    t[m_ub:m, :n] = a_eq
+    t[:m, -1] = np.concatenate([b_ub, b_eq])
+    negative = t[:m, -1] < 0
+    t[:m][negative] *= -1
+    t[:m, n + m_ub:n + m_ub + m] = np.eye(m)
+    basis = np.arange(n + m_ub, n + m_ub + m)
+
+    # Phase 1: drive the artificials to zero. The phase-1 objective is a sum of non-negative
+    # artificials, so anything but ~0 either way means infeasible (or numerically lost).
+    t[-1, n + m_ub:n + m_ub + m] = 1.0
+    t[-1] -= t[:m].sum(axis=0)
+    pivots = _pivot_to_optimum(t, basis, n + m_ub + m, max_pivots)[1]
+    if abs(t[-1, -1]) > TOL * max(1.0, np.abs(t[:m, -1]).max(initial=0.0)):
+        return None
+
+    # Pivot remaining artificials out of the basis, dropping redundant rows
+    keep = np.ones(m, dtype=bool)
+    for i in range(m):
+        if basis[i] >= n + m_ub:
+            row = np.abs(t[i, :n + m_ub])
+            if row.max(initial=0.0) > PIVOT_TOL:
+                _pivot(t, basis, i, int(np.argmax(row)))
+            else:
+                keep[i] = False
+    t = np.vstack([t[:m][keep], t[-1:]])
+    basis = basis[keep]
+    t = np.hstack([t[:, :n + m_ub], t[:, -1:]])
+
+    # Phase 2 on the real costs
+    t[-1] = 0.0
+    t[-1, :n] = c
+    for i, j in enumerate(basis):
+        t[-1] -= t[-1, j] * t[i]
+    if not _pivot_to_optimum(t, basis, n + m_ub, max_pivots - pivots)[0]:
+        return None
+
+    y = np.zeros(n + m_ub)
+    y[basis] = t[:-1, -1]
+    return low + y[:n]
+
+
+def _pivot(t, basis, i, j):
+    t[i] /= t[i, j]
+    column = t[:, j].copy()
+    column[i] = 0.0
+    t -= np.outer(column, t[i])
+    basis[i] = j
+
+
+def _pivot_to_optimum(t, basis, n_cols, max_pivots):
+    # (optimal, pivots made); optimal is False when unbounded. Dantzig's rule (most negative
+    # reduced cost) with the largest pivot element among ratio ties, switching to Bland's rule
+    # while pivots stay degenerate so the method cannot cycle.
+    m = len(basis)
+    degenerate = 0
+    for pivots in range(max_pivots + 1):
+        reduced = t[-1, :n_cols]
+        entering = np.flatnonzero(reduced < -TOL)
+        if not len(entering):
+            return True, pivots
+        if pivots == max_pivots:
+            break
+        bland = degenerate >= DEGENERATE_PIVOTS
+        j = entering[0] if bland else entering[np.argmin(reduced[entering])]
+        column = t[:m, j]
+        positive = column > PIVOT_TOL
+        if not positive.any():
+            return False, pivots   # unbounded
+        ratios = np.full(m, np.inf)
+        ratios[positive] = np.maximum(t[:m, -1][positive], 0.0) / column[positive]
+        step = ratios.min()
+        ties = np.flatnonzero(ratios <= step + TOL)
+        i = ties[np.argmin(basis[ties])] if bland else ties[np.argmax(column[ties])]
+        degenerate = degenerate + 1 if step <= TOL else 0
+        _pivot(t, basis, i, j)
+    raise SolverFailed(f"The optimizer gave up after {max_pivots} pivots without reaching an optimum")
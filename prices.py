@@ -0,0 +1,297 @@
+import argparse
+import csv
+import datetime
+import io
+import json
+import os
+import re
+import threading
+
+import numpy as np
+
+from batch import evaluate_batch, reprice_batch
+from calculator import INGREDIENT_CELLS, Formulation
+from formulas import COST_CELLS, OUTPUT_CELLS
+from schema import SCHEMA
+from sheet import DEFAULT_CSV
+
+# Versioned price lists. A price list is imported once from CSV or JSON and stored as an
+# immutable version file (price_tables/<version>.json); loaded, it is one read-only cost-per-kg
+# vector over INGREDIENT_CELLS (NaN where unpriced), cached process-wide so every session and
+# batch job resolves costs by version instead of having them typed in.
+#
+#   CSV:  a header row with an ingredient column (cell, ingredient or name) and a price column
+#         (cost, price or cost_per_kg)
+#   JSON: {"version": ..., "prices": {ingredient: cost}}, a bare {ingredient: cost} mapping or a
+#         list of {"ingredient": ..., "cost": ...} records
+#
+# Ingredients may be given by cell (B2), name or alias, in any case.
+
+# Version files go under FEED_PRICE_DIR when set, else price_tables/ next to this file
+DEFAULT_PRICE_DIR = (os.environ.get("FEED_PRICE_DIR")
+                     or os.path.join(os.path.dirname(os.path.abspath(__file__)), "price_tables"))
+VERSION_PATTERN = re.compile(r"^[A-Za-z0-9][A-Za-z0-9._-]*$")
+INGREDIENT_COLUMNS = ("cell", "ingredient", "name")
+PRICE_COLUMNS = ("cost", "price", "cost_per_kg")
+
+_INGREDIENT_KEYS = {}      # lower-cased cell, name or alias -> ingredient cell
+for _cell, _name, _aliases in zip(SCHEMA.ingredient_cells, SCHEMA.ingredient_names, SCHEMA.ingredient_aliases):
+    for _key in (_name, *_aliases):
+        _INGREDIENT_KEYS.setdefault(_key.strip().lower(), _cell)
+for _cell in SCHEMA.ingredient_cells:
+    _INGREDIENT_KEYS[_cell.lower()] = _cell
+del _cell, _name, _aliases, _key
+_CELL_INDEX = {cell: i for i, cell in enumerate(INGREDIENT_CELLS)}
+
+
+class PriceTable:
+    # One version of the price list: costs[i] is the cost per kg of INGREDIENT_CELLS[i]
+
+    def __init__(self, version, costs, imported=None, source=None):
+        self.version = version
+        self.costs = np.array(costs, dtype=float)
+        self.costs.setflags(write=False)
+        self.imported = imported
+        self.source = source
+
+    def cost(self, cell):
+        value = self.costs[_CELL_INDEX[cell]]
+        return None if value != value else float(value)
+
+    def prices(self):
+        # {cell: cost} for every priced ingredient
+        return {cell: float(c) for cell, c in zip(INGREDIENT_CELLS, self.costs.tolist()) if c == c}
+
+    def unpriced(self, cells):
+        return [cell for cell in cells if self.cost(cell) is None]
+
+    def formulation(self, quantities):
+        # quantities priced from this version; unpriced ingredients get no cost (so F20 is NA)
+        costs = {cell: self.cost(cell) for cell in quantities if self.cost(cell) is not None}
+        return Formulation(quantities, costs, price_version=self.version)
+
+    def to_json(self):
+        return {
+            "version": self.version,
+            "imported": self.imported,
+            "source": self.source,
+            "prices": self.prices(),
+        }
+
+
+def ingredient_cell(key):
+    cell = _INGREDIENT_KEYS.get(str(key).strip().lower())
+    if cell is None:
+        raise ValueError(f"Unknown ingredient {key!r}")
+    return cell
+
+
+def _pick_column(fieldnames, candidates, what):
+    by_name = {name.strip().lower(): name for name in fieldnames or ()}
+    for candidate in candidates:
+        if candidate in by_name:
+            return by_name[candidate]
+    raise ValueError(f"Price list needs a {what} column ({', '.join(candidates)})")
+
+
+def parse_prices(text, fmt):
+    # (version named in the file or None, {cell: cost}) from CSV or JSON text
+    version = None
+    if fmt == "json":
+        data = json.loads(text)
+        if isinstance(data, dict) and "prices" in data:
+            version = data.get("version")
+            if version is not None:
+                if isinstance(version, bool) or not isinstance(version, (str, int, float)):
+                    raise ValueError(f"Price list version must be a string, not {version!r}")
+                version = str(version)
+            data = data["prices"]
+        if isinstance(data, dict):
+            records = list(data.items())
+        elif isinstance(data, list):
+            records = []
+            for i, r in enumerate(data, 1):
+                if not isinstance(r, dict):
+                    raise ValueError(f"Price list entry {i} is not an object: {r!r}")
+                records.append((r.get("cell") or r.get("ingredient") or r.get("name"),
+                                r.get("cost", r.get("price", r.get("cost_per_kg")))))
+        else:
+            raise ValueError("JSON price list must be an object or a list")
+    else:
+        reader = csv.DictReader(io.StringIO(text))
+        key_column = _pick_column(reader.fieldnames, INGREDIENT_COLUMNS, "ingredient")
+        cost_column = _pick_column(reader.fieldnames, PRICE_COLUMNS, "price")
+        records = [(row[key_column], row[cost_column]) for row in reader if (row[key_column] or "").strip()]
+
+    prices = {}
+    unknown = []
+    for key, cost in records:
+        try:
+            cell = ingredient_cell(key)
+        except ValueError:
+            unknown.append(str(key))
+            continue
+        if cost in (None, ""):
+            continue
+        try:
+            cost = float(cost)
+        except (TypeError, ValueError):
+            raise ValueError(f"Price for {key!r} is not a number: {cost!r}") from None
+        if not np.isfinite(cost):
+            raise ValueError(f"Price for {key!r} is not a finite number")
+        if cost < 0:
+            raise ValueError(f"Negative price for {key!r}")
+        prices[cell] = cost
+    if unknown:
+        raise ValueError(f"Unknown ingredients in price list: {', '.join(unknown)}")
+    return version, prices
+
+
+def costs_vector(prices):
+    costs = np.full(len(INGREDIENT_CELLS), np.nan)
+    for cell, cost in prices.items():
+        costs[_CELL_INDEX[cell]] = cost
+    return costs
+
+
+_table_cache = {}      # version file path -> (file signature, PriceTable), shared by every session
+_table_lock = threading.Lock()
+
+
+def _read_table(path):
+    stat = os.stat(path)
+    signature = (stat.st_mtime_ns, stat.st_size)
+    cached = _table_cache.get(path)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+    with _table_lock:
+        cached = _table_cache.get(path)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+        with open(path) as f:
+            data = json.load(f)
+        table = PriceTable(
+            data["version"], costs_vector({cell: float(c) for cell, c in data["prices"].items()}),
+            data.get("imported"), data.get("source"),
+        )
+        _table_cache[path] = (signature, table)
+        return table
+
+
+class PriceBook:
+    # The price-list versions in one directory. Versions are immutable once imported.
+
+    def __init__(self, directory=DEFAULT_PRICE_DIR):
+        self.directory = os.path.abspath(directory)
+
+    def _path(self, version):
+        if not isinstance(version, str) or not VERSION_PATTERN.match(version):
+            raise ValueError(f"Invalid price version {version!r}: use letters, digits, '.', '_' and '-'")
+        return os.path.join(self.directory, f"{version}.json")
+
+    def versions(self):
+        # Version names, oldest import first
+        try:
+            names = [name[:-5] for name in os.listdir(self.directory) if name.endswith(".json")]
+        except FileNotFoundError:
+            return []
+        tables = [self.get(name) for name in names if VERSION_PATTERN.match(name)]
+        return [t.version for t in sorted(tables, key=lambda t: (t.imported or "", t.version))]
+
+    def __contains__(self, version):
+        return os.path.exists(self._path(version))
+
+    def get(self, version):
+        try:
+            return _read_table(self._path(version))
+        except FileNotFoundError:
+            raise KeyError(f"No price version {version!r}") from None
+
+    def latest(self):
+        versions = self.versions()
+        return self.get(versions[-1]) if versions else None
+
+    def add(self, prices, version=None, source=None):
+        # Store {cell: cost} as a new version (default: today's date, suffixed if taken) and
+        # return its PriceTable. Re-importing identical prices under a taken version returns
+        # the existing one; different prices under a taken version are refused.
+        costs = costs_vector(prices)
+        if version is None:
+            base = datetime.date.today().isoformat()
+            version, n = base, 1
+            while version in self and not np.array_equal(self.get(version).costs, costs, equal_nan=True):
+                n += 1
+                version = f"{base}.{n}"
+        path = self._path(version)
+        if version in self:
+            existing = self.get(version)
+            if not np.array_equal(existing.costs, costs, equal_nan=True):
+                raise ValueError(f"Price version {version!r} already exists with different prices")
+            return existing
+
+        table = PriceTable(version, costs, datetime.datetime.now().isoformat(timespec="seconds"), source)
+        os.makedirs(self.directory, exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(table.to_json(), f, indent=2)
+        os.replace(tmp, path)
+        return self.get(version)
+
+    def import_text(self, text, fmt, version=None, source=None):
+        named, prices = parse_prices(text, fmt)
+        return self.add(prices, version or named, source)
+
+    def import_file(self, path, version=None):
+        fmt = "json" if path.endswith(".json") else "csv"
+        with open(path, newline='') as f:
+            return self.import_text(f.read(), fmt, version, os.path.basename(path))
+
+    def matrix(self, versions):
+        # len(versions) x len(INGREDIENT_CELLS) costs, one row per version
+        return np.vstack([self.get(version).costs for version in versions])
+
+
+def price_history(formulation, book, versions=None, path=DEFAULT_CSV):
+    # formulation's COST_CELLS outputs under each price version (default: all), oldest first:
+    # one evaluation for the nutrient side, then one reprice_batch over every version
+    versions = book.versions() if versions is None else list(versions)
+    if not versions:
+        return versions, np.empty((0, len(COST_CELLS)))
+    quantities = np.array([[formulation.quantities.get(cell, 0.0) for cell in INGREDIENT_CELLS]])
+    outputs = evaluate_batch(quantities, None, path)
+    shape = (len(versions), len(INGREDIENT_CELLS))
+    repriced = reprice_batch(
+        np.broadcast_to(quantities, shape), book.matrix(versions),
+        np.broadcast_to(outputs, (len(versions), outputs.shape[1])), path,
+    )
+    return versions, repriced[:, [OUTPUT_CELLS.index(cell) for cell in COST_CELLS]]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import and list versioned ingredient price lists.")
+    parser.add_argument("--dir", default=DEFAULT_PRICE_DIR, help="price version directory")
+    commands = parser.add_subparsers(dest="command", required=True)
+    add = commands.add_parser("import", help="import a CSV or JSON price list as a new version")
+    add.add_argument("file")
+    add.add_argument("--version", help="version name (default: the file's, else today's date)")
+    commands.add_parser("list", help="list the stored versions")
+    show = commands.add_parser("show", help="print one version's prices")
+    show.add_argument("version")
+    args = parser.parse_args(argv)
+
+    book = PriceBook(args.dir)
+    if args.command == "import":
+        table = book.import_file(args.file, args.version)
+        print(f"{table.version}: {len(table.prices())} of {len(INGREDIENT_CELLS)} ingredients priced")
+    elif args.command == "list":
+        for version in book.versions():
+            table = book.get(version)
+            print(f"{version:24} {table.imported or '':20} {len(table.prices()):3} priced  {table.source or ''}")
+    else:
+        names = dict(zip(SCHEMA.ingredient_cells, SCHEMA.ingredient_names))
+        for cell, cost in book.get(args.version).prices().items():
+            print(f"{cell:5} {names[cell]:32} {cost:10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+# Opt-in profiling of the calculation path. Off unless FEED_PROFILE is set (or enable() is
+# called); while off, the hooks hand back the original functions and cost one flag check.
+# Counters are process-wide: call counts, cumulative time and self time (cumulative minus
+# time spent in nested profiled calls) per name.
+
+logger = logging.getLogger("feed.profile")
+METRIC_PREFIX = "feed"
+
+
+class Profiler:
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self._stats = {}            # name -> [calls, cumulative seconds, self seconds]
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def enable(self, enabled=True):
+        self.enabled = enabled
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+    def _record(self, name, elapsed, self_time):
+        with self._lock:
+            stats = self._stats.get(name)
+            if stats is None:
+                stats = self._stats[name] = [0, 0.0, 0.0]
+            stats[0] += 1
+            stats[1] += elapsed
+            stats[2] += self_time
+
+    @contextmanager
+    def timer(self, name):
+        if not self.enabled:
+            yield
+            return
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        stack.append(0.0)       # time spent in nested profiled calls
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            children = stack.pop()
+            if stack:
+                stack[-1] += elapsed
+            self._record(name, elapsed, elapsed - children)
+
+    def call(self, name, func, *args):
+        with self.timer(name):
+            return func(*args)
+
+    def wrap(self, name, func):
+        # func itself while profiling is off, else a timed wrapper
+        if not self.enabled:
+            return func
+
+        @wraps(func)
+        def timed(*args):
+            with self.timer(name):
+                return func(*args)
+        return timed
+
+    def snapshot(self):
+        # {name: {"calls", "seconds", "self_seconds"}}, slowest first
+        with self._lock:
+            items = [(name, list(stats)) for name, stats in self._stats.items()]
+        items.sort(key=lambda item: item[1][1], reverse=True)
+        return {
+            name: {"calls": calls, "seconds": seconds, "self_seconds": self_seconds}
+            for name, (calls, seconds, self_seconds) in items
+        }
+
+
+PROFILER = Profiler(enabled=os.environ.get("FEED_PROFILE", "") not in ("", "0"))
+
+
+def profiled(name):
+    # Decorator: time every call under name while profiling is on
+    def decorate(func):
+        @wraps(func)
+        def timed(*args, **kwargs):
+            if not PROFILER.enabled:
+                return func(*args, **kwargs)
+            with PROFILER.timer(name):
+                return func(*args, **kwargs)
+        return timed
+    return decorate
+
+
+def _label(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"')
+
+
+def prometheus_text(profiler=PROFILER, caches=None):
+    # Counters in the Prometheus text exposition format. caches: {name: stats() dict with
+    # hits and misses}, e.g. {"results": RESULT_CACHE.stats()}
+    snapshot = profiler.snapshot()
+    lines = []
+    for metric, key, help_text in [
+        ("calls_total", "calls", "Calls per profiled function"),
+        ("seconds_total", "seconds", "Cumulative seconds per profiled function"),
+        ("self_seconds_total", "self_seconds", "Seconds per profiled function excluding nested profiled calls"),
+    ]:
+        lines.append(f"# HELP {METRIC_PREFIX}_{metric} {help_text}")
+        lines.append(f"# TYPE {METRIC_PREFIX}_{metric} counter")
+        for name, stats in snapshot.items():
+            lines.append(f'{METRIC_PREFIX}_{metric}{{name="{_label(name)}"}} {stats[key]!r}')
+    for metric in ("hits", "misses"):
+        lines.append(f"# HELP {METRIC_PREFIX}_cache_{metric}_total Cache {metric}")
+        lines.append(f"# TYPE {METRIC_PREFIX}_cache_{metric}_total counter")
+        for cache, stats in (caches or {}).items():
+            lines.append(f'{METRIC_PREFIX}_cache_{metric}_total{{cache="{_label(cache)}"}} {stats[metric]}')
+    return "\n".join(lines) + "\n"
+
+
+def log_counters(profiler=PROFILER, caches=None, level=logging.INFO):
+    # The same counters as one JSON log line
+    logger.log(level, json.dumps({"profile": profiler.snapshot(), "caches": caches or {}}, sort_keys=True))
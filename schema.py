@@ -0,0 +1,63 @@
+import hashlib
+import json
+import os
+
+from sheet import col_letters_for, parse_cell_ref
+
+# The ingredient and output catalogue: which cells are ingredients, where the composition
+# table sits, and how each results-panel output is labelled, grouped and computed.
+# Adding an ingredient or a per-kg nutrient output is an edit to schema.json.
+DEFAULT_SCHEMA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "schema.json")
+INGREDIENT_KINDS = ("feed", "additive")
+
+
+class Schema:
+    # Column-wise view of a schema file: one tuple per field, all indexed alike
+
+    def __init__(self, spec):
+        # Identifies the catalogue for caches built from it
+        self.digest = hashlib.sha256(json.dumps(spec, sort_keys=True).encode()).hexdigest()
+        composition = spec["composition"]
+        first_qty, last_qty = (parse_cell_ref(cell) for cell in composition["quantities"])
+        first, last = (parse_cell_ref(cell) for cell in composition["table"])
+        if last_qty[0] - first_qty[0] != last[0] - first[0]:
+            raise ValueError("Schema needs one quantity cell per composition table row")
+        self.quantity_cells = tuple(f"{first_qty[2]}{r}" for r in range(first_qty[0], last_qty[0] + 1))
+        self.table_rows = range(first[0], last[0] + 1)
+        self.nutrient_columns = tuple(col_letters_for(c) for c in range(first[1], last[1] + 1))
+        self.header_row = composition["header_row"]
+        self.totals_row = composition["totals_row"]
+
+        ingredients = spec["ingredients"]
+        self.ingredient_cells = tuple(i["cell"] for i in ingredients)
+        self.ingredient_names = tuple(i["name"] for i in ingredients)
+        self.ingredient_kinds = tuple(i.get("kind", "feed") for i in ingredients)
+        self.ingredient_aliases = tuple(tuple(i.get("aliases", ())) for i in ingredients)
+        for cell, kind in zip(self.ingredient_cells, self.ingredient_kinds):
+            if kind not in INGREDIENT_KINDS:
+                raise ValueError(f"Unknown kind {kind!r} for ingredient {cell}")
+
+        # Outputs in results order. per_kg: {cell: weight} summed then divided by the total
+        # quantity; total: {cell: weight} summed as is; neither: computed in formulas.py.
+        outputs = spec["outputs"]
+        self.groups = tuple(spec["groups"])
+        self.output_cells = tuple(o["cell"] for o in outputs)
+        self.output_labels = tuple(o["label"] for o in outputs)
+        self.output_groups = tuple(o["group"] for o in outputs)
+        self.output_terms = tuple(o.get("per_kg") or o.get("total") for o in outputs)
+        self.output_per_kg = tuple("per_kg" in o for o in outputs)
+        for cell, group in zip(self.output_cells, self.output_groups):
+            if group not in self.groups:
+                raise ValueError(f"Unknown group {group!r} for output {cell}")
+
+        for name, cells in [("ingredient", self.ingredient_cells), ("output", self.output_cells)]:
+            if len(set(cells)) != len(cells):
+                raise ValueError(f"Schema lists an {name} cell more than once")
+
+
+def load_schema(path=DEFAULT_SCHEMA):
+    with open(path) as f:
+        return Schema(json.load(f))
+
+
+SCHEMA = load_schema()
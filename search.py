@@ -0,0 +1,168 @@
+import heapq
+import re
+import threading
+from bisect import bisect_left
+
+# Ingredient search: prefix, token and one-typo matching over ingredient names and their
+# trade aliases. The index is built once per ingredient catalogue; lookups only touch
+# the tokens that can match.
+
+# Ranking, best first: the whole name against the query, then each word against the name's words
+EXACT, NAME_PREFIX, WORDS = range(3)
+TOKEN, TOKEN_PREFIX, TYPO = range(3)
+ALIAS_PENALTY = 0.5
+MIN_TYPO_LENGTH = 4   # shorter tokens match too much with an edit
+MAX_RANKED = 4096     # short-word queries whose ranked results are kept per index
+
+
+def normalize(text):
+    return " ".join(tokenize(text))
+
+
+def tokenize(text):
+    return re.findall(r"[a-z0-9]+", text.lower())
+
+
+def _with_prefix(sorted_items, prefix):
+    i = bisect_left(sorted_items, prefix)
+    while i < len(sorted_items) and sorted_items[i].startswith(prefix):
+        yield sorted_items[i]
+        i += 1
+
+
+def _deletes(token):
+    return {token[:i] + token[i + 1:] for i in range(len(token))}
+
+
+def _within_one_edit(a, b):
+    # Levenshtein distance <= 1, plus a single adjacent transposition
+    if a == b:
+        return True
+    if abs(len(a) - len(b)) > 1:
+        return False
+    if len(a) > len(b):
+        a, b = b, a
+    i = 0
+    while i < len(a) and a[i] == b[i]:
+        i += 1
+    if len(a) == len(b):
+        if a[i + 1:] == b[i + 1:]:
+            return True
+        return i + 1 < len(a) and a[i] == b[i + 1] and a[i + 1] == b[i] and a[i + 2:] == b[i + 2:]
+    return a[i:] == b[i + 1:]
+
+
+class IngredientIndex:
+    # names: {key: display name} in catalogue order; aliases: {key: (other names, ...)}
+
+    def __init__(self, names, aliases=None):
+        aliases = aliases or {}
+        self.keys = list(names)
+        self._rank = {key: i for i, key in enumerate(self.keys)}
+        self._names = {}        # normalized name -> [(key, is alias)]
+        postings = {}           # token -> {key: is alias}
+        for key, label in names.items():
+            for alias, name in [(False, label)] + [(True, a) for a in aliases.get(key, ())]:
+                self._names.setdefault(normalize(name), []).append((key, alias))
+                for token in tokenize(name):
+                    entries = postings.setdefault(token, {})
+                    entries[key] = entries.get(key, True) and alias
+        self._postings = postings
+        self._tokens = sorted(postings)
+        self._sorted_names = sorted(self._names)
+        deletes = {}
+        for token in self._tokens:
+            if len(token) >= MIN_TYPO_LENGTH:
+                for variant in _deletes(token) | {token}:
+                    deletes.setdefault(variant, []).append(token)
+        self._deletes = deletes
+        self._short = {}        # matches for one- and two-letter words, which hit a large share of the index
+        self._ranked = {}       # ranked keys for queries made only of such words (typed first, sorted slowest)
+
+    def search(self, query, limit=None):
+        # Keys matching every word of query, best match first
+        words = tokenize(query)
+        if not words:
+            return []
+        if all(len(word) <= 2 for word in words):
+            phrase = " ".join(words)
+            ranked = self._ranked.get(phrase)
+            if ranked is None:
+                ranked = tuple(self._rank_matches(words))
+                if len(self._ranked) >= MAX_RANKED:
+                    self._ranked.clear()
+                self._ranked[phrase] = ranked
+            return list(ranked[:limit])
+        return self._rank_matches(words, limit)
+
+    def _rank_matches(self, words, limit=None):
+        best = None
+        for word in words:
+            found = self._match_token(word)
+            if best is None:
+                best = found
+            else:
+                best = {key: best[key] + found[key] for key in best.keys() & found.keys()}
+            if not best:
+                return []
+
+        # A whole name equal to or starting with the query beats words matched separately
+        phrase = " ".join(words)
+        tiers = dict.fromkeys(best, WORDS)
+        for name in _with_prefix(self._sorted_names, phrase):
+            tier = EXACT if name == phrase else NAME_PREFIX
+            for key, alias in self._names[name]:
+                if key in tiers:
+                    tiers[key] = min(tiers[key], tier + (ALIAS_PENALTY if alias else 0))
+
+        rank = lambda key: (tiers[key], best[key], self._rank[key])
+        if limit is None:
+            return sorted(best, key=rank)
+        return heapq.nsmallest(limit, best, key=rank)
+
+    def _match_token(self, word):
+        # {key: best quality} for index tokens equal to, starting with, or one edit from word
+        if len(word) <= 2:
+            found = self._short.get(word)
+            if found is None:
+                found = self._short[word] = self._scan(word)
+            return found
+        return self._scan(word)
+
+    def _scan(self, word):
+        found = {}
+
+        def add(token, quality):
+            for key, alias in self._postings[token].items():
+                score = quality + (ALIAS_PENALTY if alias else 0)
+                if found.get(key, TYPO + 1) > score:
+                    found[key] = score
+
+        for token in _with_prefix(self._tokens, word):
+            add(token, TOKEN if token == word else TOKEN_PREFIX)
+        if len(word) >= MIN_TYPO_LENGTH:
+            candidates = set()
+            for variant in _deletes(word) | {word}:
+                candidates.update(self._deletes.get(variant, ()))
+            for token in candidates:
+                if token != word and _within_one_edit(word, token):
+                    add(token, TYPO)
+        return found
+
+
+_index_cache = {}     # catalogue -> IngredientIndex
+_index_lock = threading.Lock()
+
+
+def ingredient_index_for(catalogue, names, aliases=None):
+    # One index per ingredient catalogue, shared by every session. catalogue is a hashable
+    # identity for names and aliases (e.g. SCHEMA.digest); they are only read to build the index.
+    index = _index_cache.get(catalogue)
+    if index is None:
+        with _index_lock:
+            index = _index_cache.get(catalogue)
+            if index is None:
+                index = IngredientIndex(names, aliases)
+                _index_cache.clear()
+                _index_cache[catalogue] = index
+    return index
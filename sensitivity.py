@@ -0,0 +1,118 @@
+import numpy as np
+
+from calculator import calculate
+from formulas import FORMULAS, OUTPUT_CELLS, TOTAL_COST
+from sheet import DEFAULT_CSV
+
+# Sensitivity of every output to the ingredient quantities: the formula graph is run once
+# on dual numbers (value plus gradient over the chosen ingredients), so each output comes
+# back with its exact partial derivatives instead of one finite-difference rerun per ingredient.
+
+
+class Dual:
+    # value + grad . dq; grad has one entry per ingredient being differentiated
+
+    __slots__ = ("value", "grad")
+    __hash__ = None
+
+    def __init__(self, value, grad):
+        self.value = value
+        self.grad = grad
+
+    def __add__(self, other):
+        if isinstance(other, Dual):
+            return Dual(self.value + other.value, self.grad + other.grad)
+        return Dual(self.value + other, self.grad)
+
+    __radd__ = __add__
+
+    def __neg__(self):
+        return Dual(-self.value, -self.grad)
+
+    def __sub__(self, other):
+        return self + -other
+
+    def __rsub__(self, other):
+        return -self + other
+
+    def __mul__(self, other):
+        if isinstance(other, Dual):
+            return Dual(self.value * other.value, self.grad * other.value + other.grad * self.value)
+        return Dual(self.value * other, self.grad * other)
+
+    __rmul__ = __mul__
+
+    def __truediv__(self, other):
+        if isinstance(other, Dual):
+            value = self.value / other.value
+            return Dual(value, (self.grad - other.grad * value) / other.value)
+        return Dual(self.value / other, self.grad / other)
+
+    def __rtruediv__(self, other):
+        value = other / self.value
+        return Dual(value, -self.grad * value / self.value)
+
+    def __eq__(self, other):
+        return self.value == (other.value if isinstance(other, Dual) else other)
+
+    def __ne__(self, other):
+        return not self == other
+
+
+class Sensitivity:
+    # jacobian[i, j]: change in OUTPUT_CELLS[i] per kg more of cells[j]; values: the outputs
+
+    def __init__(self, cells, values, jacobian):
+        self.cells = cells
+        self.values = values
+        self.jacobian = jacobian
+
+    def effect(self, step):
+        # Linear estimate of each output's change when every ingredient alone rises by step kg
+        return self.jacobian * step
+
+
+def sensitivity(formulation, cells=None, path=DEFAULT_CSV):
+    # Partial derivatives of every output with respect to cells (default: the formulation's
+    # ingredients), around the formulation's quantities
+    cells = list(formulation.quantities if cells is None else cells)
+    calculation = calculate(formulation, path)
+    matrix = calculation.matrix
+    context = calculation.context
+    n = len(cells)
+    position = {cell: j for j, cell in enumerate(cells)}
+
+    # d(totals row)/dq_j is the ingredient's composition row; d(batch cost)/dq_j its cost per kg
+    rows = [matrix.quantity_cells.index(cell) if cell in matrix.quantity_cells else None for cell in cells]
+    totals_grad = np.zeros((n, len(matrix.labels)))
+    for j, row in enumerate(rows):
+        if row is not None:
+            totals_grad[j] = matrix.values[row]
+    batch_cost = context.get_cell_value(TOTAL_COST)
+    cost_grad = np.array([formulation.costs.get(cell, 0.0) for cell in cells], dtype=float)
+    if batch_cost != batch_cost:
+        cost_grad[:] = np.nan
+
+    def resolve(cell):
+        value = context.get_cell_value(cell)
+        if cell in position:
+            grad = np.zeros(n)
+            grad[position[cell]] = 1.0
+            return Dual(value, grad)
+        if cell in matrix.index:
+            return Dual(value, totals_grad[:, matrix.index[cell]])
+        if cell == TOTAL_COST:
+            return Dual(value, cost_grad)
+        return value
+
+    evaluation = FORMULAS.evaluate(resolve)
+    values = np.empty(len(OUTPUT_CELLS))
+    jacobian = np.zeros((len(OUTPUT_CELLS), n))
+    for i, cell in enumerate(OUTPUT_CELLS):
+        result = evaluation.values[cell]
+        if isinstance(result, Dual):
+            values[i] = result.value
+            jacobian[i] = result.grad
+        else:
+            values[i] = result
+    return Sensitivity(cells, values, jacobian)
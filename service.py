@@ -0,0 +1,335 @@
+import argparse
+import asyncio
+import http.client
+import json
+import logging
+import multiprocessing
+import os
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from batch import evaluate_batch, recipe_arrays, result_record
+from calculator import INGREDIENT_CELLS, RESULT_CACHE, Formulation, calculate
+from engine import load_nutrient_matrix
+from formulas import OUTPUT_CELLS
+from optimize import DEFAULT_BATCH_SIZE, InfeasibleFormulation, least_cost
+from profiling import prometheus_text
+from schema import SCHEMA
+from sheet import DEFAULT_CSV, load_sheet
+from store import DEFAULT_STORE, open_store
+
+# JSON-over-HTTP front end to the formulation engine, for callers other than the Streamlit
+# page. Single evaluations run on the event loop (they hit the result cache or take well under
+# a millisecond); batches and optimizations go to a process pool whose workers each map the
+# same compiled sheet cache.
+#
+#   POST /evaluate        {"B2": 560, "cost_B2": 26, ...}             -> {"id", <label>: value, ...}
+#   POST /batch-evaluate  {"recipes": [{"id": ..., "B2": ..., ...}]}  -> {"results": [...]}
+#   POST /optimize        {"costs": {"B2": 26, ...}, "batch_size": 1000}
+#                                                                     -> {"quantities": {...}, "results": {...}}
+#   GET  /health, GET /metrics (Prometheus text)
+#
+# Recipes use the batch CLI's row format: ingredient cells as keys, cost_<cell> for costs.
+# Given a store file, every evaluated and optimized formulation is also kept there, named by
+# its id; a store that cannot be written is logged and does not fail the request.
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+MAX_BODY = 64 * 2 ** 20
+MAX_RECIPES = 200000
+# The optimizer chooses among feed ingredients only; additives are dosed separately
+FEED_CELLS = [cell for cell, kind in zip(SCHEMA.ingredient_cells, SCHEMA.ingredient_kinds) if kind == "feed"]
+
+logger = logging.getLogger("feed.service")
+
+STATUS_TEXT = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+               413: "Payload Too Large", 422: "Unprocessable Entity", 500: "Internal Server Error"}
+
+
+class RequestError(ValueError):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def formulation_from_row(row):
+    quantities = {}
+    costs = {}
+    for cell in INGREDIENT_CELLS:
+        qty = float(row.get(cell) or 0)
+        if qty > 0:
+            quantities[cell] = qty
+            costs[cell] = float(row.get(f"cost_{cell}") or 0)
+    return Formulation(quantities, costs)
+
+
+def _store_calculation(store, calculation, path, row_id):
+    if store is None:
+        return
+    try:
+        open_store(store).add_calculation(calculation, path, None if row_id is None else str(row_id))
+    except sqlite3.Error as e:
+        logger.warning("Formulation not stored in %s: %s", store, e)
+
+
+# Run in the pool workers
+
+def _init_worker(path):
+    # Map the compiled sheet and build the matrix once per worker, not per request
+    load_nutrient_matrix(path)
+
+
+def _batch_evaluate(rows, path, store=None):
+    quantities, costs = recipe_arrays(rows)
+    results = evaluate_batch(quantities, costs, path=path)
+    if store is not None:
+        try:
+            names = [str(row.get("id", i)) for i, row in enumerate(rows)]
+            open_store(store).add_batch(quantities, costs, results, load_sheet(path).digest, names)
+        except sqlite3.Error as e:
+            logger.warning("Batch not stored in %s: %s", store, e)
+    return [result_record(row.get("id", i), values) for i, (row, values) in enumerate(zip(rows, results.tolist()))]
+
+
+def _optimize(costs, batch_size, path, store=None):
+    loaded = load_sheet(path)
+    quantities = least_cost(load_nutrient_matrix(path), loaded.grid, costs, batch_size)
+    formulation = Formulation({cell: q for cell, q in quantities.items() if q > 0}, costs)
+    calculation = calculate(formulation, path)
+    _store_calculation(store, calculation, path, None)
+    return quantities, output_record(None, calculation)
+
+
+def output_record(row_id, calculation):
+    return result_record(row_id, [calculation.evaluation.values[cell] for cell in OUTPUT_CELLS])
+
+
+class FormulationService:
+
+    def __init__(self, path=DEFAULT_CSV, workers=None, store=None):
+        self.path = os.path.abspath(path)
+        self.store = None if store is None else os.path.abspath(store)
+        self.workers = workers or os.cpu_count() or 1
+        self.pool = None
+        self.requests = {}      # (path, status) -> count
+        self.seconds = {}       # path -> cumulative handling time
+
+    def start_pool(self):
+        # Compile the sheet cache before the workers map it. Workers start from a fork server rather
+        # than forking this process, whose event loop may be running in another thread.
+        load_nutrient_matrix(self.path)
+        self.pool = ProcessPoolExecutor(
+            self.workers, multiprocessing.get_context("forkserver"), _init_worker, (self.path,)
+        )
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+            self.pool = None
+
+    async def run_in_pool(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.pool, func, *args)
+
+    async def dispatch(self, method, path, body):
+        routes = {
+            "/evaluate": ("POST", self.evaluate),
+            "/batch-evaluate": ("POST", self.batch_evaluate),
+            "/optimize": ("POST", self.optimize),
+            "/health": ("GET", self.health),
+            "/metrics": ("GET", self.metrics),
+        }
+        if path not in routes:
+            raise RequestError(404, f"No endpoint {path}")
+        expected, handler = routes[path]
+        if method != expected:
+            raise RequestError(405, f"{path} takes {expected}")
+        if method == "GET":
+            return await handler()
+        try:
+            payload = json.loads(body or b"null")
+        except ValueError:
+            raise RequestError(400, "Body is not valid JSON")
+        if not isinstance(payload, dict):
+            raise RequestError(400, "Body must be a JSON object")
+        return await handler(payload)
+
+    async def evaluate(self, payload):
+        calculation = calculate(formulation_from_row(payload), self.path)
+        _store_calculation(self.store, calculation, self.path, payload.get("id"))
+        return output_record(payload.get("id"), calculation)
+
+    async def batch_evaluate(self, payload):
+        rows = payload.get("recipes")
+        if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+            raise RequestError(400, "recipes must be a list of objects")
+        if len(rows) > MAX_RECIPES:
+            raise RequestError(413, f"At most {MAX_RECIPES} recipes per request")
+        for i, row in enumerate(rows):
+            row.setdefault("id", i)
+        return {"results": await self.run_in_pool(_batch_evaluate, rows, self.path, self.store)}
+
+    async def optimize(self, payload):
+        costs = payload.get("costs")
+        if not isinstance(costs, dict) or not costs:
+            raise RequestError(400, "costs must map ingredient cells to cost per kg")
+        unknown = [cell for cell in costs if cell not in INGREDIENT_CELLS]
+        if unknown:
+            raise RequestError(400, f"Unknown ingredient cells: {', '.join(unknown)}")
+        additives = [cell for cell in costs if cell not in FEED_CELLS]
+        if additives:
+            raise RequestError(
+                400, f"Only feed ingredients can be optimized; {', '.join(additives)} "
+                     f"{'is an additive' if len(additives) == 1 else 'are additives'}"
+            )
+        costs = {cell: float(cost) for cell, cost in costs.items()}
+        batch_size = float(payload.get("batch_size", DEFAULT_BATCH_SIZE))
+        try:
+            quantities, results = await self.run_in_pool(_optimize, costs, batch_size, self.path, self.store)
+        except InfeasibleFormulation as e:
+            raise RequestError(422, str(e))
+        results.pop("id")
+        return {"quantities": quantities, "results": results}
+
+    async def health(self):
+        return {"status": "ok", "workers": self.workers, "sheet": load_sheet(self.path).digest}
+
+    async def metrics(self):
+        lines = [prometheus_text(caches={"results": RESULT_CACHE.stats()}).rstrip("\n")]
+        lines.append("# TYPE feed_http_requests_total counter")
+        for (path, status), count in sorted(self.requests.items()):
+            lines.append(f'feed_http_requests_total{{path="{path}",status="{status}"}} {count}')
+        lines.append("# TYPE feed_http_request_seconds_total counter")
+        for path, seconds in sorted(self.seconds.items()):
+            lines.append(f'feed_http_request_seconds_total{{path="{path}"}} {seconds!r}')
+        return "\n".join(lines) + "\n"
+
+    async def handle(self, method, path, body):
+        # (status, content type, body bytes) for one request
+        start = time.perf_counter()
+        try:
+            result = await self.dispatch(method, path, body)
+            status = 200
+        except RequestError as e:
+            status, result = e.status, {"error": str(e)}
+        except (ValueError, TypeError, KeyError) as e:
+            status, result = 400, {"error": str(e)}
+        except Exception as e:
+            status, result = 500, {"error": f"{type(e).__name__}: {e}"}
+        key = path if path in ("/evaluate", "/batch-evaluate", "/optimize", "/health", "/metrics") else "other"
+        self.requests[(key, status)] = self.requests.get((key, status), 0) + 1
+        self.seconds[key] = self.seconds.get(key, 0.0) + time.perf_counter() - start
+        if isinstance(result, str):
+            return status, "text/plain; version=0.0.4", result.encode()
+        return status, "application/json", json.dumps(result).encode()
+
+    async def serve_connection(self, reader, writer):
+        # HTTP/1.1 with keep-alive; one request at a time per connection
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                try:
+                    method, target, version = request_line.decode("latin-1").split()
+                except ValueError:
+                    await self.respond(writer, 400, "application/json", b'{"error": "Malformed request line"}', False)
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                keep_alive = (headers.get("connection", "").lower() != "close"
+                              and (version == "HTTP/1.1" or headers.get("connection", "").lower() == "keep-alive"))
+                length = headers.get("content-length") or "0"
+                if not (length.isascii() and length.isdigit()):
+                    await self.respond(writer, 400, "application/json", b'{"error": "Invalid Content-Length"}', False)
+                    break
+                length = int(length)
+                if length > MAX_BODY:
+                    await self.respond(writer, 413, "application/json", b'{"error": "Body too large"}', False)
+                    break
+                body = await reader.readexactly(length) if length else b""
+                status, content_type, payload = await self.handle(method, target.split("?", 1)[0], body)
+                await self.respond(writer, status, content_type, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, writer, status, content_type, payload, keep_alive):
+        head = (
+            f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(payload)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        )
+        writer.write(head.encode("latin-1") + payload)
+        await writer.drain()
+
+    async def serve(self, host=DEFAULT_HOST, port=DEFAULT_PORT, ready=None):
+        self.start_pool()
+        server = await asyncio.start_server(self.serve_connection, host, port, limit=MAX_BODY)
+        if ready is not None:
+            ready(server)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.close()
+
+
+class Client:
+    # Minimal blocking client for the service, e.g. as a stand-in for the ERP side in tests
+
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, timeout=60):
+        self.connection = http.client.HTTPConnection(host, port, timeout=timeout)
+
+    def request(self, method, path, payload=None):
+        body = None if payload is None else json.dumps(payload)
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        self.connection.request(method, path, body=body, headers=headers)
+        response = self.connection.getresponse()
+        data = response.read()
+        if response.getheader("Content-Type", "").startswith("application/json"):
+            data = json.loads(data)
+        return response.status, data
+
+    def evaluate(self, recipe):
+        return self.request("POST", "/evaluate", recipe)
+
+    def batch_evaluate(self, recipes):
+        return self.request("POST", "/batch-evaluate", {"recipes": recipes})
+
+    def optimize(self, costs, batch_size=DEFAULT_BATCH_SIZE):
+        return self.request("POST", "/optimize", {"costs": costs, "batch_size": batch_size})
+
+    def close(self):
+        self.connection.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the formulation engine as a JSON HTTP API.")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--workers", type=int, help="pool processes for batches and optimize (default: CPUs)")
+    parser.add_argument("--sheet", default=DEFAULT_CSV, help="nutrient database CSV")
+    parser.add_argument("--store", default=DEFAULT_STORE, help="formulation store to keep every evaluation in")
+    parser.add_argument("--no-store", action="store_true", help="do not store evaluations")
+    args = parser.parse_args(argv)
+
+    service = FormulationService(args.sheet, args.workers, None if args.no_store else args.store)
+    ready = lambda server: print(f"Serving on http://{args.host}:{args.port} with {service.workers} workers")
+    try:
+        asyncio.run(service.serve(args.host, args.port, ready))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
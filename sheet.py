@@ -0,0 +1,239 @@
+import argparse
+import csv
+import hashlib
+import io
+import json
+import os
+import re
+import threading
+
+import numpy as np
+
+DEFAULT_CSV = os.path.join(os.path.dirname(os.path.abspath(__file__)), "converted_file.csv")
+
+def parse_cell_ref(cell_ref):
+    col_letters = ''.join(filter(str.isalpha, cell_ref)).upper()
+    row_number_1based = int(''.join(filter(str.isdigit, cell_ref)))
+    col_index_0based = 0
+    for ch in col_letters:
+        col_index_0based = col_index_0based * 26 + (ord(ch) - ord('A') + 1)
+    col_index_0based -= 1
+    return row_number_1based, col_index_0based, col_letters
+
+def col_letters_for(col_index_0based):
+    letters = ""
+    n = col_index_0based + 1
+    while n > 0:
+        n, rem = divmod(n - 1, 26)
+        letters = chr(ord('A') + rem) + letters
+    return letters
+
+def parse_number(s):
+    if s is None:
+        return None
+    s = str(s).strip()
+    if s == "":
+        return None
+    s2 = s.replace(",", "")
+    m = re.search(r"-?\d+(?:\.\d+)?", s2)
+    if m:
+        return float(m.group())
+    return None
+
+def is_plain_number(s):
+    try:
+        float(s.replace(",", ""))
+    except ValueError:
+        return False
+    return True
+
+class CellIndex:
+    # Address -> (row, col) lookups for a grid of the given shape, parsed on first use
+    # rather than tabulated for every cell up front
+
+    def __init__(self, shape):
+        self.shape = shape
+        self._positions = {}
+
+    def get(self, cell, default=None):
+        pos = self._positions.get(cell)
+        if pos is None:
+            try:
+                row, col, _ = parse_cell_ref(cell)
+            except ValueError:
+                return default
+            if not (1 <= row <= self.shape[0] and 0 <= col < self.shape[1]):
+                return default
+            pos = self._positions[cell] = (row - 1, col)
+        return pos
+
+    def __getitem__(self, cell):
+        pos = self.get(cell)
+        if pos is None:
+            raise KeyError(cell)
+        return pos
+
+    def __contains__(self, cell):
+        return self.get(cell) is not None
+
+class SheetGrid:
+    # Sheet compiled at load time: floats (NaN for blanks/text) in Excel coordinates, and
+    # the original text of every cell that is not a plain number
+
+    def __init__(self, values, strings):
+        self.values = np.asarray(values)    # a plain view, also of a memory-mapped cache file
+        self.values.setflags(write=False)   # shared by every session
+        self.strings = strings              # {(row, col): text}
+        self.index = CellIndex(values.shape)
+
+    @classmethod
+    def from_rows(cls, rows):
+        # The export's first row and first column are headers, not sheet cells
+        body = [row[1:] for row in rows[1:]]
+        n_rows = len(body)
+        n_cols = max((len(row) for row in body), default=0)
+        values = np.full((n_rows, n_cols), np.nan)
+        strings = {}
+        for r, row in enumerate(body):
+            for c, raw in enumerate(row):
+                num = parse_number(raw)
+                if num is not None:
+                    values[r, c] = num
+                if raw.strip() and not is_plain_number(raw):
+                    strings[(r, c)] = raw
+        return cls(values, strings)
+
+    def value(self, cell):
+        # Numeric value of cell, 0.0 for blanks, text and cells outside the sheet
+        pos = self.index.get(cell)
+        if pos is None:
+            return 0.0
+        num = self.values[pos]
+        return 0.0 if num != num else float(num)
+
+    def text(self, cell):
+        # Text of cell as written in the sheet, "" for numbers, blanks and cells outside it
+        pos = self.index.get(cell)
+        return self.strings.get(pos, "") if pos is not None else ""
+
+    def block(self, first_cell, last_cell):
+        # Rectangular range with blanks and text as 0.0; a view of the shared values when
+        # the range is all numbers
+        r0, c0 = self.index[first_cell]
+        r1, c1 = self.index[last_cell]
+        block = self.values[r0:r1 + 1, c0:c1 + 1]
+        if np.isnan(block).any():
+            return np.nan_to_num(block, nan=0.0)
+        return block
+
+class SheetData:
+    # Compiled grid of a CSV sheet and the content hash it came from
+
+    def __init__(self, path, grid, digest, signature):
+        self.path = path
+        self.grid = grid
+        self.digest = digest
+        self.signature = signature
+
+
+# Compiled sheets live next to the CSV as <name>.<digest>.npy (values, memory-mapped so
+# every process shares one page-cached copy) and <name>.<digest>.json (text cells)
+CACHE_DIR = ".sheet_cache"
+CACHE_FORMAT = 1
+
+def cache_paths(path, digest):
+    base = os.path.join(os.path.dirname(path), CACHE_DIR, f"{os.path.basename(path)}.{digest[:16]}")
+    return base + ".npy", base + ".json"
+
+def read_compiled(path, digest):
+    values_path, strings_path = cache_paths(path, digest)
+    try:
+        with open(strings_path) as f:
+            meta = json.load(f)
+        if meta.get("format") != CACHE_FORMAT or meta.get("digest") != digest:
+            return None
+        values = np.load(values_path, mmap_mode="r")
+    except (OSError, ValueError):
+        return None
+    return SheetGrid(values, {(r, c): text for r, c, text in meta["strings"]})
+
+def write_compiled(path, digest, grid):
+    # Best effort: a read-only directory just means the next process parses the CSV again
+    values_path, strings_path = cache_paths(path, digest)
+    cache_dir = os.path.dirname(values_path)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        prefix = os.path.basename(path) + "."
+        for name in os.listdir(cache_dir):
+            if name.startswith(prefix) and not name.startswith(prefix + digest[:16]):
+                os.remove(os.path.join(cache_dir, name))
+        meta = {
+            "format": CACHE_FORMAT,
+            "digest": digest,
+            "strings": [[r, c, text] for (r, c), text in sorted(grid.strings.items())],
+        }
+        for target, write in [
+            (values_path, lambda f: np.save(f, np.asarray(grid.values))),
+            (strings_path, lambda f: f.write(json.dumps(meta).encode())),
+        ]:
+            tmp = f"{target}.{os.getpid()}.tmp"
+            with open(tmp, "wb") as f:
+                write(f)
+            os.replace(tmp, target)
+    except OSError:
+        pass
+
+def compile_sheet(path, data):
+    # Grid for the CSV bytes in data: from the compiled cache when it matches, else parsed and cached
+    digest = hashlib.sha256(data).hexdigest()
+    grid = read_compiled(path, digest)
+    if grid is None:
+        reader = csv.reader(io.TextIOWrapper(io.BytesIO(data), newline=''))
+        grid = SheetGrid.from_rows(tuple(tuple(row) for row in reader))
+        write_compiled(path, digest, grid)
+    return grid, digest
+
+
+_sheet_cache = {}      # path -> SheetData, shared by every session in the process
+_sheet_lock = threading.Lock()
+
+def file_signature(path):
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+def load_sheet(path):
+    # Load the CSV once per process; recompile only when its content hash changes
+    path = os.path.abspath(path)
+    signature = file_signature(path)
+    cached = _sheet_cache.get(path)
+    if cached is not None and cached.signature == signature:
+        return cached
+
+    with _sheet_lock:
+        cached = _sheet_cache.get(path)
+        if cached is not None and cached.signature == signature:
+            return cached
+        with open(path, "rb") as f:
+            data = f.read()
+        if cached is not None and cached.digest == hashlib.sha256(data).hexdigest():
+            # Touched but not edited: keep the compiled grid
+            loaded = SheetData(path, cached.grid, cached.digest, signature)
+        else:
+            grid, digest = compile_sheet(path, data)
+            loaded = SheetData(path, grid, digest, signature)
+        _sheet_cache[path] = loaded
+        return loaded
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compile sheet CSVs into the memory-mapped cache ahead of time.")
+    parser.add_argument("sheets", nargs="*", default=[DEFAULT_CSV], help="sheet CSV files")
+    args = parser.parse_args(argv)
+    for path in args.sheets:
+        loaded = load_sheet(path)
+        print(f"{path}: {loaded.grid.values.shape[0]} x {loaded.grid.values.shape[1]} -> "
+              f"{cache_paths(loaded.path, loaded.digest)[0]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,299 @@
+import datetime
+import hashlib
+import os
+import sqlite3
+import threading
+from collections import namedtuple
+
+import numpy as np
+
+from calculator import INGREDIENT_CELLS, Formulation
+from formulas import OUTPUT_CELLS, RESULT_CELLS
+from sheet import load_sheet
+
+# Every evaluated formulation and its outputs, kept in a local SQLite file so rations outlive
+# the browser tab. One row per formulation, with a column per output cell, plus an
+# (ingredient, formulation) table; lookups by id, by ingredient and by output range go through
+# indexes instead of reading every row. An output column is indexed the first time it is
+# range-queried. A formulation already stored for the same sheet contents is not stored again.
+
+DEFAULT_STORE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "formulations.db")
+DEFAULT_LIMIT = 100
+NARROW_RANGE_ROWS = 5000   # a range matching fewer rows than this drives the query
+_OUTPUT_BY_LABEL = {label: cell for label, cell in RESULT_CELLS}
+_CELLS = np.array(INGREDIENT_CELLS)
+
+
+class StoredFormulation(namedtuple("StoredFormulation", "id created name sheet_digest formulation outputs")):
+    # outputs: one value per OUTPUT_CELLS entry, NaN where the UI shows "NA"
+
+    __slots__ = ()
+
+    def results(self):
+        return {label: value for (label, _), value in zip(RESULT_CELLS, self.outputs.tolist())}
+
+
+def _bound(conditions, params, column, bounds):
+    low, high = bounds
+    if low is not None:
+        conditions.append(f"{column} >= ?")
+        params.append(low)
+    if high is not None:
+        conditions.append(f"{column} <= ?")
+        params.append(high)
+
+
+class FormulationStore:
+
+    def __init__(self, path=DEFAULT_STORE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._indexed = set()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._create()
+
+    def _create(self):
+        outputs = ", ".join(f'"{cell}" REAL' for cell in OUTPUT_CELLS)
+        self._db.executescript(f"""
+            CREATE TABLE IF NOT EXISTS formulations (
+                id INTEGER PRIMARY KEY,
+                created TEXT NOT NULL,
+                name TEXT,
+                content_key BLOB NOT NULL,
+                sheet_digest TEXT NOT NULL,
+                price_version TEXT,
+                cells TEXT NOT NULL,
+                quantities BLOB NOT NULL,
+                costs BLOB NOT NULL,
+                {outputs},
+                UNIQUE (sheet_digest, content_key)
+            );
+            CREATE TABLE IF NOT EXISTS ingredients (
+                cell TEXT NOT NULL,
+                formulation_id INTEGER NOT NULL,
+                quantity REAL NOT NULL,
+                PRIMARY KEY (cell, formulation_id)
+            ) WITHOUT ROWID;
+        """)
+        # Outputs added to schema.json since the file was created
+        existing = {row[1] for row in self._db.execute("PRAGMA table_info(formulations)")}
+        for cell in OUTPUT_CELLS:
+            if cell not in existing:
+                self._db.execute(f'ALTER TABLE formulations ADD COLUMN "{cell}" REAL')
+        self._indexed = {
+            row[0] for row in self._db.execute("SELECT name FROM sqlite_master WHERE type = 'index'")
+        }
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM formulations").fetchone()[0]
+
+    # Writing
+
+    def add(self, formulation, outputs, sheet_digest, name=None):
+        # Store one formulation with its OUTPUT_CELLS values; returns its id (the existing
+        # id when the same formulation is already stored for these sheet contents)
+        quantities = [formulation.quantities.get(cell, 0.0) for cell in INGREDIENT_CELLS]
+        costs = [formulation.costs.get(cell, 0.0) for cell in INGREDIENT_CELLS]
+        return self.add_batch([quantities], [costs], [outputs], sheet_digest, [name], formulation.price_version)[0]
+
+    def add_calculation(self, calculation, path, name=None):
+        outputs = [calculation.evaluation.values[cell] for cell in OUTPUT_CELLS]
+        return self.add(calculation.formulation, outputs, load_sheet(path).digest, name)
+
+    def add_batch(self, quantities, costs, outputs, sheet_digest, names=None, price_version=None):
+        # Rows of an evaluate_batch run in one transaction: quantities and costs (one row
+        # shared, or one per recipe) over INGREDIENT_CELLS, outputs over OUTPUT_CELLS.
+        # Returns the ids in row order.
+        quantities = np.atleast_2d(np.asarray(quantities, dtype=float))
+        used = quantities > 0
+        quantities = np.where(used, quantities, 0.0)
+        costs = np.zeros(len(INGREDIENT_CELLS)) if costs is None else np.asarray(costs, dtype=float)
+        costs = np.where(used, costs, 0.0)
+        outputs = np.asarray(outputs, dtype=float).tolist()
+        # Identity of a row: its used quantities, their costs and the price version
+        suffix = (price_version or "").encode()
+        keys = [hashlib.sha256(q.tobytes() + c.tobytes() + suffix).digest() for q, c in zip(quantities, costs)]
+        created = datetime.datetime.now().isoformat(timespec="seconds")
+        placeholders = ", ".join("?" * (9 + len(OUTPUT_CELLS)))
+        columns = ", ".join(f'"{cell}"' for cell in OUTPUT_CELLS)
+
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                known = {}
+                for start in range(0, len(keys), 500):
+                    chunk = keys[start:start + 500]
+                    known.update(self._db.execute(
+                        f"SELECT content_key, id FROM formulations WHERE sheet_digest = ? "
+                        f"AND content_key IN ({', '.join('?' * len(chunk))})", [sheet_digest] + chunk,
+                    ))
+                next_id = (self._db.execute("SELECT MAX(id) FROM formulations").fetchone()[0] or 0) + 1
+                ids = []
+                new = []
+                rows = []
+                for i, key in enumerate(keys):
+                    if key not in known:
+                        known[key] = next_id
+                        new.append(i)
+                        columns_used = np.flatnonzero(used[i])
+                        # SQLite stores NaN ("NA") as NULL
+                        rows.append([
+                            next_id, created, None if names is None else names[i], key, sheet_digest,
+                            price_version, ",".join(INGREDIENT_CELLS[j] for j in columns_used),
+                            quantities[i, columns_used].tobytes(), costs[i, columns_used].tobytes(),
+                        ] + outputs[i])
+                        next_id += 1
+                    ids.append(known[key])
+                self._db.executemany(
+                    f"INSERT INTO formulations (id, created, name, content_key, sheet_digest, price_version, "
+                    f"cells, quantities, costs, {columns}) VALUES ({placeholders})", rows,
+                )
+                new_ids = np.array([ids[i] for i in new], dtype=np.int64)
+                row_index, column_index = np.nonzero(used[new])
+                self._db.executemany(
+                    "INSERT INTO ingredients (cell, formulation_id, quantity) VALUES (?, ?, ?)",
+                    zip(_CELLS[column_index].tolist(), new_ids[row_index].tolist(),
+                        quantities[new][row_index, column_index].tolist()),
+                )
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return ids
+
+    def set_name(self, formulation_id, name):
+        with self._lock:
+            self._db.execute("UPDATE formulations SET name = ? WHERE id = ?", (name, formulation_id))
+
+    # Reading
+
+    def get(self, formulation_id):
+        stored = self.get_many([formulation_id])
+        if not stored:
+            raise KeyError(f"No stored formulation {formulation_id}")
+        return stored[0]
+
+    def get_many(self, ids):
+        # StoredFormulations for ids, in the order given (unknown ids are skipped)
+        ids = list(ids)
+        if not ids:
+            return []
+        columns = ", ".join(f'"{cell}"' for cell in OUTPUT_CELLS)
+        found = {}
+        with self._lock:
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                rows = self._db.execute(
+                    f"SELECT id, created, name, sheet_digest, price_version, cells, quantities, costs, {columns} "
+                    f"FROM formulations WHERE id IN ({', '.join('?' * len(chunk))})", chunk,
+                )
+                for row in rows:
+                    cells = row[5].split(",") if row[5] else []
+                    quantities = np.frombuffer(row[6]).tolist()
+                    costs = np.frombuffer(row[7]).tolist()
+                    formulation = Formulation(dict(zip(cells, quantities)), dict(zip(cells, costs)), row[4])
+                    outputs = np.array([np.nan if v is None else v for v in row[8:]], dtype=float)
+                    found[row[0]] = StoredFormulation(row[0], row[1], row[2], row[3], formulation, outputs)
+        return [found[i] for i in ids if i in found]
+
+    def _index(self, cell):
+        name = f"formulations_{cell}"
+        if name not in self._indexed:
+            self._db.execute(f'CREATE INDEX IF NOT EXISTS "{name}" ON formulations ("{cell}")')
+            self._indexed.add(name)
+        return name
+
+    def find(self, ingredients=(), ranges=None, limit=DEFAULT_LIMIT):
+        # Ids of stored formulations, newest first, that use every ingredient in ingredients
+        # (cells, or {cell: (min kg, max kg)} with None for an open end) and whose outputs lie
+        # within ranges ({output cell or label: (low, high)}, None for an open end)
+        if not isinstance(ingredients, dict):
+            ingredients = dict.fromkeys(ingredients, (None, None))
+        ranges = {_OUTPUT_BY_LABEL.get(output, output): bounds for output, bounds in (ranges or {}).items()}
+        for cell in ranges:
+            if cell not in OUTPUT_CELLS:
+                raise KeyError(f"Unknown output {cell!r}")
+        cells = list(ingredients)
+
+        with self._lock:
+            # Drive the query from whichever index gets to the matches soonest: an output range
+            # matching only a few rows, else the first ingredient's (cell, id) key or the ids
+            # themselves, newest first, checking everything else per candidate
+            range_cell = self._narrow_range(ranges)
+            if range_cell is not None:
+                sql = f'SELECT f.id FROM formulations f INDEXED BY "{self._index(range_cell)}"'
+                id_column = "f.id"
+                lookups = cells
+            elif cells:
+                sql = "SELECT i.formulation_id FROM ingredients i"
+                if ranges:
+                    sql += " CROSS JOIN formulations f ON f.id = i.formulation_id"
+                id_column = "i.formulation_id"
+                lookups = cells[1:]
+            else:
+                sql = "SELECT f.id FROM formulations f NOT INDEXED"
+                id_column = "f.id"
+                lookups = []
+
+            conditions = []
+            params = []
+            if range_cell is None and cells:
+                conditions.append("i.cell = ?")
+                params.append(cells[0])
+                _bound(conditions, params, "i.quantity", ingredients[cells[0]])
+            for n, cell in enumerate(lookups):
+                alias = f"i{n}"
+                inner = [f"{alias}.cell = ?", f"{alias}.formulation_id = {id_column}"]
+                params.append(cell)
+                _bound(inner, params, f"{alias}.quantity", ingredients[cell])
+                conditions.append(f"EXISTS (SELECT 1 FROM ingredients {alias} WHERE {' AND '.join(inner)})")
+            for cell, bounds in ranges.items():
+                _bound(conditions, params, f'f."{cell}"', bounds)
+
+            if conditions:
+                sql += " WHERE " + " AND ".join(conditions)
+            sql += f" ORDER BY {id_column} DESC"
+            if limit is not None:
+                sql += " LIMIT ?"
+                params.append(limit)
+            return [row[0] for row in self._db.execute(sql, params)]
+
+    def _narrow_range(self, ranges):
+        # The output whose range matches fewest rows, if that is under NARROW_RANGE_ROWS;
+        # counting stops there, so a wide range costs no more than a narrow one to size up
+        best, best_count = None, NARROW_RANGE_ROWS
+        for cell, bounds in ranges.items():
+            conditions, params = [], []
+            _bound(conditions, params, f'"{cell}"', bounds)
+            if not conditions:
+                continue
+            count = self._db.execute(
+                f'SELECT COUNT(*) FROM (SELECT 1 FROM formulations INDEXED BY "{self._index(cell)}" '
+                f'WHERE {" AND ".join(conditions)} LIMIT ?)', params + [NARROW_RANGE_ROWS],
+            ).fetchone()[0]
+            if count < best_count:
+                best, best_count = cell, count
+        return best
+
+    def recent(self, limit=DEFAULT_LIMIT):
+        return self.find(limit=limit)
+
+
+_stores = {}           # absolute path -> FormulationStore, shared by every session
+_stores_lock = threading.Lock()
+
+
+def open_store(path=DEFAULT_STORE):
+    path = os.path.abspath(path)
+    with _stores_lock:
+        store = _stores.get(path)
+        if store is None:
+            store = _stores[path] = FormulationStore(path)
+        return store
@@ -0,0 +1,87 @@
+from collections import namedtuple
+
+import numpy as np
+
+from batch import evaluate_batch
+from calculator import INGREDIENT_CELLS
+from formulas import OUTPUT_CELLS, ratio
+from sheet import DEFAULT_CSV
+
+# What-if sweeps: one or two ingredient quantities stepped over a grid around a formulation,
+# every grid point evaluated through evaluate_batch a chunk at a time so results can be
+# shown as they arrive and memory stays bounded by the chunk size.
+
+# (label, output cell) per reported metric; Ca:P is F11 / F12
+SWEEP_METRICS = [
+    ("Crude Protein (%)", "F2"),
+    ("ME (Mcal/Kg)", "F3"),
+    ("Ca:P Ratio", ("F11", "F12")),
+    ("Margin", "F22"),
+]
+CHUNK_SIZE = 10000
+MAX_SWEEP_POINTS = 1000000   # grid points per sweep, across all axes
+
+
+class SweepChunk(namedtuple("SweepChunk", "start stop values")):
+    # values: (stop - start) x len(SWEEP_METRICS) for grid points start..stop-1 in row-major order
+
+    __slots__ = ()
+
+
+def axis_values(low, high, step):
+    # low, low + step, ..., high (inclusive, the last step shortened to land on high)
+    if step <= 0 or high < low:
+        raise ValueError("Sweep needs a positive step and high >= low")
+    count = int(np.floor((high - low) / step + 1e-9)) + 1
+    if count > MAX_SWEEP_POINTS:
+        raise ValueError(f"Sweep axis would have {count:,} points; use a larger step (at most {MAX_SWEEP_POINTS:,})")
+    values = low + step * np.arange(count)
+    return values if values[-1] >= high - 1e-9 else np.append(values, high)
+
+
+def metric_columns(outputs):
+    # The SWEEP_METRICS columns of an evaluate_batch result
+    columns = []
+    for _, cell in SWEEP_METRICS:
+        if isinstance(cell, tuple):
+            numerator, denominator = (outputs[:, OUTPUT_CELLS.index(c)] for c in cell)
+            columns.append(ratio(numerator, denominator))
+        else:
+            columns.append(outputs[:, OUTPUT_CELLS.index(cell)])
+    return np.column_stack(columns)
+
+
+def sweep(formulation, axes, path=DEFAULT_CSV, chunk_size=CHUNK_SIZE):
+    # axes: [(ingredient cell, quantities), ...], one or two of them. Every other ingredient
+    # keeps the formulation's quantity and all keep its costs. Returns an iterator of
+    # SweepChunks in order; raises ValueError up front for grids over MAX_SWEEP_POINTS.
+    grids = [np.asarray(values, dtype=float) for _, values in axes]
+    total = int(np.prod([len(grid) for grid in grids], dtype=float))
+    if total > MAX_SWEEP_POINTS:
+        raise ValueError(f"Sweep would evaluate {total:,} points; use larger steps (at most {MAX_SWEEP_POINTS:,})")
+    return _chunks(formulation, [cell for cell, _ in axes], grids, path, chunk_size)
+
+
+def _chunks(formulation, cells, grids, path, chunk_size):
+    shape = tuple(len(grid) for grid in grids)
+    columns = [INGREDIENT_CELLS.index(cell) for cell in cells]
+    base = np.array([formulation.quantities.get(cell, 0.0) for cell in INGREDIENT_CELLS], dtype=float)
+    costs = np.array([formulation.costs.get(cell, 0.0) for cell in INGREDIENT_CELLS], dtype=float)
+
+    total = int(np.prod(shape))
+    for start in range(0, total, chunk_size):
+        stop = min(total, start + chunk_size)
+        quantities = np.tile(base, (stop - start, 1))
+        for column, grid, index in zip(columns, grids, np.unravel_index(np.arange(start, stop), shape)):
+            quantities[:, column] = grid[index]
+        yield SweepChunk(start, stop, metric_columns(evaluate_batch(quantities, costs, path)))
+
+
+def sweep_grid(formulation, axes, path=DEFAULT_CSV, chunk_size=CHUNK_SIZE):
+    # All metrics at once: array of shape (len(axis values), ...) + (len(SWEEP_METRICS),)
+    chunks = sweep(formulation, axes, path, chunk_size)
+    shape = tuple(len(values) for _, values in axes)
+    values = np.empty((int(np.prod(shape)), len(SWEEP_METRICS)))
+    for chunk in chunks:
+        values[chunk.start:chunk.stop] = chunk.values
+    return values.reshape(shape + (len(SWEEP_METRICS),))
@@ -0,0 +1,30 @@
+import numpy as np
+import pytest
+
+from calculator import Formulation, calculate
+from engine import NutrientMatrix
+
+
+def test_incremental_totals_do_not_keep_rounding_residue():
+    # Removing ingredients back to one used to leave ~1e-13 in totals that should be 0, and
+    # Calorie:Protein came out as 4.9e16 instead of 0
+    full = calculate(Formulation({"B6": 224.54, "B27": 41.14, "B19": 160.71, "B21": 10}), cache=None)
+    reduced = calculate(Formulation({"B21": 10}), previous=full, cache=None)
+    fresh = calculate(Formulation({"B21": 10}), cache=None)
+    np.testing.assert_array_equal(reduced.totals, fresh.totals)
+    assert reduced.results["Calorie:Protein Ratio"] == fresh.results["Calorie:Protein Ratio"]
+
+
+def test_one_ingredient_change_updates_totals_in_place(monkeypatch):
+    previous = calculate(Formulation({"B2": 560, "B12": 330, "K2": 0.3}, {"B2": 26, "B12": 33, "K2": 683}), cache=None)
+    changed = Formulation({"B2": 561, "B12": 330, "K2": 0.3}, {"B2": 26, "B12": 33, "K2": 683})
+
+    def full_product(self, quantities):
+        raise AssertionError("incremental calculation recomputed every total")
+
+    with monkeypatch.context() as m:
+        m.setattr(NutrientMatrix, "totals_vector", full_product)
+        updated = calculate(changed, previous=previous, cache=None)
+    fresh = calculate(changed, cache=None)
+    np.testing.assert_allclose(updated.totals, fresh.totals, rtol=1e-12)
+    assert dict(updated.results) == pytest.approx(dict(fresh.results), rel=1e-12, nan_ok=True)
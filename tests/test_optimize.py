@@ -0,0 +1,123 @@
+import time
+
+import numpy as np
+import pytest
+
+import optimize
+from engine import load_nutrient_matrix
+from optimize import InfeasibleFormulation, SolverFailed, least_cost
+from schema import SCHEMA
+from sheet import DEFAULT_CSV, load_sheet
+
+FEED_CELLS = [cell for cell, kind in zip(SCHEMA.ingredient_cells, SCHEMA.ingredient_kinds) if kind == "feed"]
+
+# Cost sets from review: the first used to come back as a 990 kg mix breaking nine limits, the
+# second took over 250k degenerate pivots. Both are infeasible.
+INFEASIBLE_COSTS = {
+    'B21': 15.86, 'B5': 17.0, 'B31': 31.09, 'B3': 46.72, 'B24': 25.45, 'B8': 25.38, 'B19': 50.94,
+    'B29': 47.89, 'B17': 23.8, 'B15': 10.96, 'B27': 33.83, 'B13': 30.58, 'B20': 19.75, 'B9': 22.73,
+    'B14': 24.87, 'B28': 28.33, 'B25': 58.5, 'B23': 41.51, 'B26': 54.83, 'B22': 37.82,
+}
+DEGENERATE_COSTS = {
+    'B28': 33.2, 'B9': 40.08, 'B3': 55.14, 'B22': 36.82, 'B13': 47.39, 'B23': 26.77, 'B2': 42.51,
+    'B21': 26.1, 'B20': 21.85, 'B8': 44.15, 'B26': 36.88, 'B18': 19.8, 'B6': 33.49, 'B27': 38.99,
+    'B24': 45.13, 'B19': 6.43, 'B29': 39.98, 'B4': 37.34, 'B30': 9.14,
+}
+
+
+@pytest.fixture(scope="module")
+def sheet():
+    return load_nutrient_matrix(DEFAULT_CSV), load_sheet(DEFAULT_CSV).grid
+
+
+@pytest.fixture(params=["highs", "simplex"])
+def backend(request, monkeypatch):
+    if request.param == "highs":
+        pytest.importorskip("scipy")
+    else:
+        monkeypatch.setattr(optimize, "_scipy_linprog", None)
+    return request.param
+
+
+def _solve(sheet, costs):
+    try:
+        quantities = least_cost(*sheet, costs)
+    except InfeasibleFormulation:
+        return None
+    return sum(costs[cell] * q for cell, q in quantities.items())
+
+
+def _random_costs(rng):
+    cells = rng.choice(FEED_CELLS, size=rng.integers(3, len(FEED_CELLS) + 1), replace=False)
+    return {str(cell): float(np.round(rng.uniform(5, 60), 2)) for cell in cells}
+
+
+def test_simplex_matches_reference_lp(sheet, monkeypatch):
+    pytest.importorskip("scipy")
+    rng = np.random.default_rng(6)
+    feasible = 0
+    for _ in range(120):
+        costs = _random_costs(rng)
+        reference = _solve(sheet, costs)
+        with monkeypatch.context() as m:
+            m.setattr(optimize, "_scipy_linprog", None)
+            ours = _solve(sheet, costs)
+        if reference is None:
+            assert ours is None, costs
+        else:
+            feasible += 1
+            assert ours == pytest.approx(reference, rel=1e-9), costs
+    assert feasible
+
+
+def test_returned_mix_meets_every_limit(sheet, backend):
+    matrix, grid = sheet
+    rng = np.random.default_rng(13)
+    checked = 0
+    for _ in range(60):
+        costs = _random_costs(rng)
+        try:
+            quantities = least_cost(matrix, grid, costs, 1000.0)
+        except InfeasibleFormulation:
+            continue
+        checked += 1
+        assert sum(quantities.values()) == pytest.approx(1000.0)
+        for cell, q in quantities.items():
+            low, high = optimize.ingredient_bounds(grid, cell)
+            assert low - 1e-6 <= q <= high + 1e-6
+        rows = [matrix.quantity_cells.index(cell) for cell in quantities]
+        q = np.array(list(quantities.values()))
+        for cell, _, low, high in optimize.nutrient_limits(grid):
+            numerator, denominator = optimize.NUTRIENT_FORMS[cell]
+            n = optimize._linear_form(matrix, rows, numerator) @ q
+            d = optimize._linear_form(matrix, rows, denominator) @ q
+            if low is not None:
+                assert n >= low * d - 1e-6 * max(1.0, abs(n)), cell
+            if high is not None:
+                assert n <= high * d + 1e-6 * max(1.0, abs(n)), cell
+    assert checked
+
+
+@pytest.mark.parametrize("costs", [INFEASIBLE_COSTS, DEGENERATE_COSTS])
+def test_infeasible_selection_raises(sheet, backend, costs):
+    start = time.perf_counter()
+    with pytest.raises(InfeasibleFormulation):
+        least_cost(*sheet, costs)
+    assert time.perf_counter() - start < 2.0
+
+
+def test_pivot_limit_raises():
+    rng = np.random.default_rng(1)
+    n = 12
+    a_ub = rng.uniform(-1, 1, (8, n))
+    x0 = rng.uniform(0, 10, n)
+    with pytest.raises(SolverFailed):
+        optimize.simplex(
+            rng.uniform(-1, 1, n), a_ub, a_ub @ x0 + 1.0, np.ones((1, n)), [x0.sum()],
+            np.zeros(n), np.full(n, 20.0), max_pivots=1,
+        )
+
+
+def test_no_feed_ingredients_selected(sheet, backend):
+    with pytest.raises(InfeasibleFormulation, match="at least one feed ingredient"):
+        least_cost(*sheet, {})
@@ -0,0 +1,36 @@
+import json
+
+import pytest
+
+from prices import PriceBook, parse_prices
+
+
+def test_numeric_version_is_used_as_text(tmp_path):
+    book = PriceBook(tmp_path)
+    table = book.import_text(json.dumps({"version": 2024, "prices": {"B2": 26, "SOYA": 33}}), "json")
+    assert table.version == "2024"
+    assert book.versions() == ["2024"]
+    assert table.prices() == {"B2": 26.0, "B12": 33.0}
+
+
+@pytest.mark.parametrize("text", [
+    '[{"ingredient": "B2", "cost": 26}, "B12"]',
+    '[["B2", 26]]',
+    '{"version": ["w41"], "prices": {"B2": 26}}',
+    '{"B2": {"cost": 26}}',
+    '{"B2": "cheap"}',
+    '{"B2": NaN}',
+    '{"B2": -1}',
+    '"B2"',
+    '{"B2": ',
+])
+def test_malformed_json_is_a_value_error(text):
+    with pytest.raises(ValueError):
+        parse_prices(text, "json")
+
+
+def test_invalid_version_name_is_a_value_error(tmp_path):
+    with pytest.raises(ValueError):
+        PriceBook(tmp_path).add({"B2": 26.0}, version=2024)
+    with pytest.raises(ValueError):
+        PriceBook(tmp_path).add({"B2": 26.0}, version="week 41")
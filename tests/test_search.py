@@ -0,0 +1,21 @@
+from schema import SCHEMA
+from search import IngredientIndex, ingredient_index_for
+
+NAMES = dict(zip(SCHEMA.ingredient_cells, SCHEMA.ingredient_names))
+ALIASES = dict(zip(SCHEMA.ingredient_cells, SCHEMA.ingredient_aliases))
+
+
+def test_short_queries_are_ranked_once_and_not_shared():
+    index = IngredientIndex(NAMES, ALIASES)
+    first = index.search("s")
+    assert first and index.search("s") == first
+    first.append("junk")
+    assert "junk" not in index.search("s")
+    assert index.search("s", limit=2) == first[:2]
+    assert index.search("so ya") == IngredientIndex(NAMES, ALIASES).search("so ya")
+
+
+def test_index_is_shared_per_catalogue():
+    index = ingredient_index_for(SCHEMA.digest, NAMES, ALIASES)
+    assert ingredient_index_for(SCHEMA.digest, dict(NAMES), dict(ALIASES)) is index
+    assert ingredient_index_for("other", {"B2": "Maize"}) is not index
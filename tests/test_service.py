@@ -0,0 +1,67 @@
+import asyncio
+import json
+
+import pytest
+
+from service import FormulationService
+
+
+def _exchange(request):
+    # Send raw bytes to a pool-less service on an ephemeral port; (status, body) of the reply
+    async def run():
+        service = FormulationService()
+        server = await asyncio.start_server(service.serve_connection, "127.0.0.1", 0)
+        async with server:
+            reader, writer = await asyncio.open_connection(*server.sockets[0].getsockname()[:2])
+            writer.write(request)
+            await writer.drain()
+            reply = await asyncio.wait_for(reader.read(), 10)
+            writer.close()
+        head, _, body = reply.partition(b"\r\n\r\n")
+        return int(head.split()[1]), json.loads(body)
+
+    return asyncio.run(run())
+
+
+def _post(path, payload):
+    body = json.dumps(payload).encode()
+    return _exchange(
+        f"POST {path} HTTP/1.1\r\nConnection: close\r\nContent-Length: {len(body)}\r\n\r\n".encode() + body
+    )
+
+
+@pytest.mark.parametrize("length", [b"abc", b"-5", b"1.5", b"\xb2"])
+def test_invalid_content_length_is_rejected(length):
+    status, body = _exchange(b"POST /evaluate HTTP/1.1\r\nContent-Length: " + length + b"\r\n\r\n{}")
+    assert status == 400
+    assert body == {"error": "Invalid Content-Length"}
+
+
+def test_evaluate():
+    status, body = _post("/evaluate", {"id": 7, "B2": 560, "B12": 330, "cost_B2": 26, "cost_B12": 33})
+    assert status == 200
+    assert body["id"] == 7
+
+
+def test_optimize_rejects_additives():
+    status, body = _post("/optimize", {"costs": {"B2": 26, "K2": 683, "B12": 33}})
+    assert status == 400
+    assert "K2" in body["error"] and "additive" in body["error"]
+
+
+def test_evaluate_is_stored(tmp_path):
+    from store import open_store
+
+    path = str(tmp_path / "formulations.db")
+
+    async def run():
+        service = FormulationService(store=path)
+        return await service.evaluate({"id": 7, "B2": 560, "B12": 330, "cost_B2": 26, "cost_B12": 33})
+
+    body = asyncio.run(run())
+    store = open_store(path)
+    assert len(store) == 1
+    stored = store.get(store.recent()[0])
+    assert stored.name == "7"
+    assert stored.formulation.quantities == {"B2": 560, "B12": 330}
+    assert stored.results() == pytest.approx({k: v for k, v in body.items() if k != "id"}, nan_ok=True)
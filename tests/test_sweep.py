@@ -0,0 +1,22 @@
+import numpy as np
+import pytest
+
+from calculator import Formulation
+from sweep import MAX_SWEEP_POINTS, SWEEP_METRICS, axis_values, sweep, sweep_grid
+
+FORMULATION = Formulation({"B2": 560, "B12": 330}, {"B2": 26, "B12": 33})
+
+
+def test_sweep_grid_shape():
+    axes = [("B2", axis_values(500, 600, 50)), ("B12", axis_values(300, 330, 10))]
+    values = sweep_grid(FORMULATION, axes, chunk_size=5)
+    assert values.shape == (3, 4, len(SWEEP_METRICS))
+    assert not np.isnan(values).any()
+
+
+def test_oversized_sweeps_are_refused_before_any_work():
+    axes = [("B2", axis_values(0, 1000, 0.01)), ("B12", axis_values(0, 1000, 0.01))]
+    with pytest.raises(ValueError, match="points"):
+        sweep(FORMULATION, axes)
+    with pytest.raises(ValueError, match="points"):
+        axis_values(0, MAX_SWEEP_POINTS, 0.5)
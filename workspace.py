@@ -0,0 +1,75 @@
+import threading
+import weakref
+
+import numpy as np
+
+from batch import evaluate_batch
+from calculator import INGREDIENT_CELLS, Formulation
+from sheet import DEFAULT_CSV
+
+# Named formulations saved in one session (starter / grower / finisher, variants of each).
+# Each is kept as two read-only vectors over INGREDIENT_CELLS, quantities and costs, interned
+# process-wide: variants with the same prices share one cost vector, identical rations share
+# both, and a comparison stacks the vectors into a single evaluate_batch call.
+
+_vector_pool = weakref.WeakValueDictionary()   # vector bytes -> shared read-only vector
+_vector_lock = threading.Lock()
+
+
+def intern_vector(values):
+    vector = np.asarray(values, dtype=float)
+    key = vector.tobytes()
+    with _vector_lock:
+        shared = _vector_pool.get(key)
+        if shared is None:
+            shared = vector.copy()
+            shared.setflags(write=False)
+            _vector_pool[key] = shared
+        return shared
+
+
+class Workspace:
+
+    def __init__(self):
+        self._entries = {}      # name -> (quantities vector, costs vector, price version), in save order
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, name):
+        return name in self._entries
+
+    def names(self):
+        return list(self._entries)
+
+    def save(self, name, formulation):
+        # Save (or overwrite) name; only ingredients with a quantity are kept
+        quantities = [formulation.quantities.get(cell, 0.0) for cell in INGREDIENT_CELLS]
+        costs = [formulation.costs.get(cell, 0.0) if q > 0 else 0.0 for cell, q in zip(INGREDIENT_CELLS, quantities)]
+        self._entries.pop(name, None)
+        self._entries[name] = (intern_vector(quantities), intern_vector(costs), formulation.price_version)
+
+    def delete(self, name):
+        self._entries.pop(name, None)
+
+    def formulation(self, name):
+        quantities, costs, price_version = self._entries[name]
+        used = np.flatnonzero(quantities > 0)
+        return Formulation(
+            {INGREDIENT_CELLS[i]: float(quantities[i]) for i in used},
+            {INGREDIENT_CELLS[i]: float(costs[i]) for i in used},
+            price_version,
+        )
+
+    def price_version(self, name):
+        return self._entries[name][2]
+
+    def compare(self, names=None, path=DEFAULT_CSV):
+        # Outputs of the named formulations (default: all) in one batched pass:
+        # len(names) x len(OUTPUT_CELLS), NaN where the UI shows "NA"
+        names = self.names() if names is None else list(names)
+        if not names:
+            return names, np.empty((0, 0))
+        quantities = np.vstack([self._entries[name][0] for name in names])
+        costs = np.vstack([self._entries[name][1] for name in names])
+        return names, evaluate_batch(quantities, costs, path)